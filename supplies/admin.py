@@ -15,11 +15,17 @@ from django.db.models import Func, IntegerField, F
 from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.urls import path, reverse
+from django.utils import timezone
 from django.utils.html import format_html
 from rangefilter.filters import NumericRangeFilterBuilder
 
 from . import models
+from .services.artifacts import schedule_feed_rebuild, get_offer_shard_names
+from .services.categories import get_category_tree, invalidate_category_tree
+from .services.feed import evict_offer_fragments
+from .services.pricing import update_final_prices
 from .services.images import add_infographics_to_firs_image, add_border_to_first_image
+from .views import offers_csv_response, offers_xlsx_response
 from .tasks import generate_offer_name, generate_offer_description, generate_content_and_translate, \
     translate_offer
 
@@ -87,8 +93,8 @@ class CategoryFilter(RelatedFieldListFilter):
     def queryset(self, request, queryset):
         if not self.lookup_val:
             return queryset
-        root = self.field.related_model.objects.get(pk=int(self.lookup_val[0]))
-        kw = {f'{self.field_path}__in': root.get_all_children()}
+        tree = get_category_tree(self.field.related_model)
+        kw = {f'{self.field_path}__in': tree.get_descendants(int(self.lookup_val[0]))}
 
         return queryset.filter(**kw)
 
@@ -142,7 +148,7 @@ class OfferAdmin(admin.ModelAdmin):
         'content_hints',
         'display_supplier',
         'display_category',
-        'price',
+        'final_price',
         'link_to_supplier_offer',
         'main_image_tag',
     )
@@ -162,6 +168,7 @@ class OfferAdmin(admin.ModelAdmin):
         ("supplier_offer__category__site_category", CategoryFilter),
         "supplier_offer__available",
         ("supplier_offer__price", NumericRangeFilterBuilder()),
+        ("final_price", NumericRangeFilterBuilder()),
     ]
 
     actions = [
@@ -173,7 +180,9 @@ class OfferAdmin(admin.ModelAdmin):
         'translate',
         'add_border',
         'add_infographics',
-        'set_multiplier'
+        'set_multiplier',
+        'export_csv',
+        'export_xlsx',
     ]
 
     def get_queryset(self, request):
@@ -218,11 +227,22 @@ class OfferAdmin(admin.ModelAdmin):
 
     @admin.action(description="Deactivate offers")
     def deactivate(self, request, queryset):
-        queryset.update(active=False)
+        # updated_at is bumped explicitly, so the change gets into the delta feed
+        queryset.update(active=False, updated_at=timezone.now())
+        schedule_feed_rebuild(get_offer_shard_names(queryset))
 
     @admin.action(description="Activate offers")
     def activate(self, request, queryset):
-        queryset.update(active=True)
+        queryset.update(active=True, updated_at=timezone.now())
+        schedule_feed_rebuild(get_offer_shard_names(queryset))
+
+    @admin.action(description='Export to CSV')
+    def export_csv(self, request, queryset):
+        return offers_csv_response(queryset)
+
+    @admin.action(description='Export to XLSX')
+    def export_xlsx(self, request, queryset):
+        return offers_xlsx_response(queryset)
 
     @admin.action(description='Generate content and translate')
     def generate_content_and_translate(self, request, queryset):
@@ -250,7 +270,10 @@ class OfferAdmin(admin.ModelAdmin):
             logger.debug('APPLY IN POST')
             if form.is_valid():
                 multiplier = form.cleaned_data['multiplier']
-                queryset.update(price_multiplier=multiplier)
+                queryset.update(price_multiplier=multiplier, updated_at=timezone.now())
+                update_final_prices(queryset)
+                evict_offer_fragments(queryset.values_list('pk', flat=True))
+                schedule_feed_rebuild(get_offer_shard_names(queryset))
                 messages.add_message(request, SUCCESS, f'Price multiplier updated')
                 return HttpResponseRedirect(request.get_full_path())
         else:
@@ -340,6 +363,10 @@ class SupplierOfferAdmin(admin.ModelAdmin):
             if form.is_valid():
                 category = form.cleaned_data['category']
                 queryset.update(category=category)
+                evict_offer_fragments(
+                    models.Offer.objects.filter(supplier_offer__in=queryset).values_list('pk', flat=True)
+                )
+                schedule_feed_rebuild()
                 messages.add_message(request, SUCCESS, f'Categories updated')
                 return HttpResponseRedirect(request.get_full_path())
         else:
@@ -439,6 +466,8 @@ class CategoryAdmin(admin.ModelAdmin):
                             'parent_category_id'
                         ], unique_fields=['id']
                     )
+                    invalidate_category_tree(models.SiteCategory)
+                    schedule_feed_rebuild()
 
                 self.message_user(request, 'Data imported from XML file')
                 return HttpResponseRedirect(reverse('admin:supplies_sitecategory_changelist'))
@@ -459,3 +488,64 @@ class SupplierCategoryAdmin(admin.ModelAdmin):
             'parent_category',
             'site_category',
         )
+
+
+@admin.register(models.PriceRule)
+class PriceRuleAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'supplier', 'site_category', 'min_price', 'max_price', 'multiplier', 'active']
+    list_filter = ['active', 'supplier']
+    list_editable = ['multiplier', 'active']
+    autocomplete_fields = ['site_category']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('supplier', 'site_category')
+
+
+@admin.register(models.ImageTextVerdict)
+class ImageTextVerdictAdmin(admin.ModelAdmin):
+    list_display = ['url', 'has_text', 'regions', 'checked_at']
+    list_filter = ['has_text']
+    search_fields = ['url']
+    date_hierarchy = 'checked_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.IngestRun)
+class IngestRunAdmin(admin.ModelAdmin):
+    list_display = [
+        'started_at',
+        'supplier',
+        'status',
+        'wall_time',
+        'download_time',
+        'parse_time',
+        'categories_time',
+        'upsert_time',
+        'reconcile_time',
+        'bytes_fetched',
+        'offers',
+        'offers_per_second',
+        'new_offers',
+        'changed_offers',
+        'vanished_offers',
+        'removed_categories',
+        'errors',
+        'peak_rss',
+        'peak_rss_scope',
+    ]
+    list_filter = ['supplier', 'status']
+    date_hierarchy = 'started_at'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('supplier')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SuppliesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'supplies'
+
+    def ready(self):
+        from supplies import signals  # noqa: F401
@@ -1,8 +1,29 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import List, Dict
 
 
 @dataclass
 class ProductFeatures:
     title: str
     features: List[str]
+
+
+@dataclass
+class OffersIngestStats:
+    new: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    vanished: int = 0
+    categories: int = 0
+    orphaned_categories: int = 0
+    removed_categories: int = 0
+    errors: int = 0
+    bytes_fetched: int = 0
+    # digest of the archived feed snapshot
+    snapshot: str = ''
+    # stage name -> seconds
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def offers(self):
+        return self.new + self.changed + self.unchanged
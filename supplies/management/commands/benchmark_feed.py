@@ -0,0 +1,147 @@
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from supplies.models import Supplier, SupplierOffer, Offer
+from supplies.services.feed import (
+    save_offers, get_offers_data, gen_xml, generate_offers_xml, iter_offers_xml, evict_offer_fragments
+)
+from supplies.services.synthetic import write_yml_catalog
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'feed_baseline.json'
+# benchmarks use private caches, so fragments and category trees of the test database don't leak to the real ones
+BENCHMARK_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'benchmark-{alias}'}
+    for alias in ['default', settings.FEED_FRAGMENT_CACHE]
+}
+
+
+def measure(func, *args, **kwargs):
+    """
+    :return: result of the call and its time, number of queries and peak of python memory allocations
+    """
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'time': round(elapsed, 4), 'queries': len(queries), 'peak_memory': peak}
+
+
+def consume(chunks) -> int:
+    return sum(len(chunk) for chunk in chunks)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark feed ingest and export on synthetic catalogs in a throwaway test database. '
+        'Results are compared with the stored baseline to catch performance regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000], help='numbers of offers')
+        parser.add_argument('--params', type=int, default=5, help='params per offer')
+        parser.add_argument('--pictures', type=int, default=3, help='pictures per offer')
+        parser.add_argument('--category-depth', type=int, default=3)
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='also measure parallel export with this number of processes (needs a database reachable from them)'
+        )
+        parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help='baseline file')
+        parser.add_argument('--save-baseline', action='store_true', help='store results as the new baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='relative slowdown (or memory growth) reported as regression'
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = {}
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                for size in options['sizes']:
+                    results.update(self.run_benchmarks(size, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        regressions = self.compare(results, options['baseline'], options['tolerance'])
+
+        if options['save_baseline']:
+            options['baseline'].parent.mkdir(parents=True, exist_ok=True)
+            options['baseline'].write_text(json.dumps(results, indent=2, sort_keys=True))
+            self.stdout.write(f'Baseline saved to {options["baseline"]}')
+        elif regressions:
+            raise CommandError(f'{regressions} performance regression(s) found')
+
+    def run_benchmarks(self, size, options):
+        results = {}
+        supplier = Supplier.objects.create(name=f'benchmark-{size}', feed_url='https://example.com/feed.xml')
+
+        with tempfile.TemporaryFile() as feed_file:
+            write_yml_catalog(
+                feed_file, offers=size, params=options['params'], pictures=options['pictures'],
+                category_depth=options['category_depth'],
+            )
+            feed_file.seek(0)
+            _, results[f'save_offers[{size}]'] = measure(save_offers, feed_file, supplier)
+            feed_file.seek(0)
+            _, results[f'save_offers:unchanged[{size}]'] = measure(save_offers, feed_file, supplier)
+
+        Offer.objects.bulk_create(
+            [Offer(supplier_offer_id=id_, active=True) for id_ in
+             SupplierOffer.objects.filter(supplier=supplier).values_list('pk', flat=True)],
+            batch_size=settings.SUPPLIER_OFFERS_BATCH_SIZE,
+        )
+        queryset = Offer.objects.filter(
+            active=True, supplier_offer__supplier=supplier, supplier_offer__available=True
+        ).select_related('supplier_offer')
+
+        # every measurement gets a fresh queryset, so nothing is served from the result cache
+        offers_data, results[f'get_offers_data[{size}]'] = measure(get_offers_data, queryset.all())
+        _, results[f'gen_xml[{size}]'] = measure(gen_xml, offers_data)
+        _, results[f'generate_offers_xml[{size}]'] = measure(generate_offers_xml, queryset.all())
+
+        evict_offer_fragments()
+        _, results[f'iter_offers_xml:cold[{size}]'] = measure(consume, iter_offers_xml(queryset.all()))
+        _, results[f'iter_offers_xml:cached[{size}]'] = measure(consume, iter_offers_xml(queryset.all()))
+        if options['workers'] > 1:
+            evict_offer_fragments()
+            _, results[f'iter_offers_xml:parallel[{size}]'] = measure(
+                consume, iter_offers_xml(queryset.all(), workers=options['workers'])
+            )
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<40} {result["time"]:>10.3f}s {result["queries"]:>8} queries '
+                f'{result["peak_memory"] / 1024 / 1024:>10.1f} MiB'
+            )
+        return results
+
+    def compare(self, results, baseline_path: Path, tolerance: float) -> int:
+        if not baseline_path.exists():
+            self.stdout.write(f'No baseline found at {baseline_path}')
+            return 0
+
+        baseline = json.loads(baseline_path.read_text())
+        regressions = 0
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            for metric in ['time', 'queries', 'peak_memory']:
+                expected = baseline[name][metric]
+                allowed = expected if metric == 'queries' else expected * (1 + tolerance)
+                if result[metric] > allowed:
+                    regressions += 1
+                    self.stdout.write(self.style.ERROR(
+                        f'{name}: {metric} regressed from {expected} to {result[metric]}'
+                    ))
+        return regressions
@@ -1,10 +1,35 @@
 from django.core.management.base import BaseCommand, CommandError
 
 from supplies.models import Supplier
-from supplies.services.feed import load_offers
+from supplies.tasks import update_feed, update_feeds
 
 
 class Command(BaseCommand):
+    help = 'Load offers from feeds of active suppliers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suppliers', nargs='*', help='names of suppliers to load (all active by default)')
+        parser.add_argument(
+            '--parallel', action='store_true',
+            help='dispatch feed updates of all active suppliers to celery workers'
+        )
+
     def handle(self, *args, **options):
-        load_offers(Supplier.objects.filter(name='lugi', active=True).first())
-        # load_offers(Supplier.objects.filter(name='dropship-b2b', active=True).first())
+        if options['parallel']:
+            update_feeds.delay()
+            self.stdout.write(self.style.SUCCESS('Feed updates dispatched'))
+            return
+
+        suppliers = Supplier.objects.filter(active=True)
+        if options['suppliers']:
+            suppliers = suppliers.filter(name__in=options['suppliers'])
+        if not suppliers:
+            raise CommandError('No active suppliers found')
+
+        for supplier in suppliers:
+            result = update_feed(supplier.pk)
+            self.stdout.write(f'{result["supplier"]}: {result["status"]} in {result["duration"]}s')
+            if result['stats']:
+                self.stdout.write(self.style.SUCCESS(f'Offers loaded: {result["stats"]}'))
+            if result['error']:
+                self.stdout.write(self.style.ERROR(result['error']))
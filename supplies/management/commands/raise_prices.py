@@ -1,9 +1,12 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import ExpressionWrapper, F, FloatField, Value
 from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from supplies.models import Supplier, Offer
+from supplies.services.artifacts import schedule_feed_rebuild
 from supplies.services.feed import load_offers
+from supplies.services.pricing import update_final_prices
 
 
 def multiply_and_update_field(model_queryset, field_name, multiplier):
@@ -13,11 +16,14 @@ def multiply_and_update_field(model_queryset, field_name, multiplier):
             ExpressionWrapper(
                 F(field_name) * multiplier, output_field=FloatField()),
             Value(multiplier)
-        )}
+        )},
+        updated_at=timezone.now(),
     )
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
         multiply_and_update_field(Offer.objects.all(), 'price_multiplier', 1.2)
+        update_final_prices()
+        schedule_feed_rebuild()
         # load_offers(Supplier.objects.filter(name='lugi', active=True).first())
         # load_offers(Supplier.objects.filter(name='dropship-b2b', active=True).first())
@@ -0,0 +1,39 @@
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from supplies.models import Supplier, Offer
+from supplies.services.artifacts import schedule_feed_rebuild, get_offer_shard_names
+from supplies.services.feed import save_offers, supplier_feed_lock
+from supplies.services.snapshots import find_snapshot, list_snapshots, open_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Ingest archived supplier feed snapshot without downloading the feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('supplier', help='supplier name')
+        parser.add_argument('--snapshot', help='snapshot digest or its prefix (the most recent one by default)')
+        parser.add_argument('--list', action='store_true', help='list archived snapshots and exit')
+
+    def handle(self, *args, **options):
+        supplier = Supplier.objects.filter(name=options['supplier']).first()
+        if not supplier:
+            raise CommandError(f'Supplier {options["supplier"]} does not exist')
+
+        if options['list']:
+            for path in list_snapshots(supplier):
+                self.stdout.write(f'{path.name}\t{path.stat().st_size}')
+            return
+
+        path = find_snapshot(supplier, options['snapshot'])
+        if not path:
+            raise CommandError(f'No {supplier} feed snapshot found')
+
+        self.stdout.write(f'Replaying {path.name}')
+        with supplier_feed_lock(supplier), open_snapshot(path) as feed_file:
+            stats = save_offers(feed_file, supplier)
+        # offers are written in bulk bypassing signals, so the materialized feed is rebuilt explicitly
+        schedule_feed_rebuild(get_offer_shard_names(Offer.objects.filter(supplier_offer__supplier=supplier)))
+
+        self.stdout.write(self.style.SUCCESS(f'Offers loaded: {asdict(stats)}'))
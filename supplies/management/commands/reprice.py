@@ -0,0 +1,39 @@
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from supplies.models import Offer
+from supplies.services.artifacts import schedule_feed_rebuild
+from supplies.services.pricing import preview_repricing, apply_repricing
+
+
+class Command(BaseCommand):
+    help = 'Preview (or apply with --apply) price multipliers of offers matched by price rules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true', help='write new multipliers')
+        parser.add_argument('--supplier', help='reprice offers of the supplier only')
+        parser.add_argument('--limit', type=int, default=20, help='number of changed offers to show')
+
+    def handle(self, *args, **options):
+        offers = Offer.objects.all()
+        if options['supplier']:
+            offers = offers.filter(supplier_offer__supplier__name=options['supplier'])
+
+        started_at = time.perf_counter()
+        preview = preview_repricing(offers)
+        elapsed = time.perf_counter() - started_at
+        changed = preview[preview['changed']]
+
+        self.stdout.write(
+            f'{len(preview)} offers matched by price rules, {len(changed)} to change (computed in {elapsed:.3f}s)'
+        )
+        if not changed.empty:
+            with pd.option_context('display.width', 200, 'display.max_columns', None):
+                self.stdout.write(changed.head(options['limit']).to_string())
+
+        if options['apply'] and not changed.empty:
+            updated = apply_repricing(preview)
+            schedule_feed_rebuild()
+            self.stdout.write(self.style.SUCCESS(f'{updated} offers repriced'))
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0013_offer_suggested_price'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='supplieroffer',
+            constraint=models.UniqueConstraint(fields=('supplier', 'id'), name='unique_supplier_offer_id'),
+        ),
+    ]
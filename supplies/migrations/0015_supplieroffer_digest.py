@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0014_supplieroffer_unique_supplier_offer_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplieroffer',
+            name='digest',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
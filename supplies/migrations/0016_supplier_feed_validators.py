@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0015_supplieroffer_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplier',
+            name='feed_etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
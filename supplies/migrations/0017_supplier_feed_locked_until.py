@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0016_supplier_feed_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplier',
+            name='feed_locked_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0017_supplier_feed_locked_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplier',
+            name='field_mapping',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0018_supplier_field_mapping'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('updated', 'Updated'), ('not_modified', 'Not modified'), ('locked', 'Locked'), ('failed', 'Failed')], default='running', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('bytes_fetched', models.BigIntegerField(default=0)),
+                ('new_offers', models.PositiveIntegerField(default=0)),
+                ('changed_offers', models.PositiveIntegerField(default=0)),
+                ('unchanged_offers', models.PositiveIntegerField(default=0)),
+                ('vanished_offers', models.PositiveIntegerField(default=0)),
+                ('categories', models.PositiveIntegerField(default=0)),
+                ('orphaned_categories', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('wall_time', models.FloatField(blank=True, null=True)),
+                ('download_time', models.FloatField(blank=True, null=True)),
+                ('parse_time', models.FloatField(blank=True, null=True)),
+                ('categories_time', models.FloatField(blank=True, null=True)),
+                ('upsert_time', models.FloatField(blank=True, null=True)),
+                ('reconcile_time', models.FloatField(blank=True, null=True)),
+                ('peak_rss', models.PositiveIntegerField(blank=True, null=True)),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_runs', to='supplies.supplier')),
+            ],
+            options={
+                'verbose_name': 'Ingest Run',
+                'verbose_name_plural': 'Ingest Runs',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0019_ingestrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestrun',
+            name='snapshot',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0021_supplieroffer_param_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('multiplier', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('active', models.BooleanField(default=True)),
+                ('site_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='price_rules', to='supplies.sitecategory')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_rules', to='supplies.supplier')),
+            ],
+            options={
+                'verbose_name': 'Price Rule',
+                'verbose_name_plural': 'Price Rules',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-18 10:01
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Ceil, Coalesce, NullIf
+
+
+def fill_final_price(apps, schema_editor):
+    Offer = apps.get_model('supplies', 'Offer')
+    SupplierOffer = apps.get_model('supplies', 'SupplierOffer')
+    supplier_price = Subquery(SupplierOffer.objects.filter(pk=OuterRef('supplier_offer_id')).values('price')[:1])
+    Offer.objects.update(final_price=Ceil(
+        Coalesce(NullIf(F('suggested_price'), Value(Decimal(0))), supplier_price)
+        * Coalesce(NullIf(F('price_multiplier'), Value(Decimal(0))), Value(Decimal(1))),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0022_pricerule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='final_price',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.RunPython(fill_final_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0023_offer_final_price'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='offer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='supplieroffer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0024_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageTextVerdict',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=2000, unique=True)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=64)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('has_text', models.BooleanField()),
+                ('regions', models.PositiveIntegerField()),
+                ('checked_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Image Text Verdict',
+                'verbose_name_plural': 'Image Text Verdicts',
+            },
+        ),
+    ]
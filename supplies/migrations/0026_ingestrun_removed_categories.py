@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0025_imagetextverdict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestrun',
+            name='removed_categories',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
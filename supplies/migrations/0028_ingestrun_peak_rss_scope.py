@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplies', '0027_cache_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestrun',
+            name='peak_rss_scope',
+            field=models.CharField(blank=True, choices=[('run', 'Run'), ('process', 'Process lifetime')], max_length=16),
+        ),
+    ]
@@ -5,33 +5,47 @@ from django.utils.safestring import mark_safe
 
 class TreeMixin:
     def get_children_filters(self, include_self=True):
-        filters = Q(pk=0)
-        if include_self:
-            filters |= Q(pk=self.pk)
-        for c in self.__class__.objects.filter(parent_category=self):
-            _r = c.get_children_filters(include_self=True)
-            if _r:
-                filters |= _r
-        return filters
+        from supplies.services.categories import get_category_tree
+
+        return Q(pk__in=get_category_tree(self.__class__).get_descendants(self.pk, include_self))
 
     def get_all_children(self, include_self=True):
         return self.__class__.objects.filter(self.get_children_filters(include_self))
 
 
+class UpdatedAtMixin:
+    """
+    Bumps auto_now `updated_at` on partial saves too, Django only sets it when it's listed in update_fields.
+    Cached feed fragments and the delta feed rely on updated_at changing with every save.
+    """
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is not None and 'updated_at' not in update_fields:
+            update_fields = [*update_fields, 'updated_at']
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+
 class Supplier(models.Model):
     _id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=255)
     feed_url = models.URLField(max_length=1000)
     active = models.BooleanField(default=False)
+    # validators of the last ingested feed, used for conditional requests
+    feed_etag = models.CharField(max_length=255, blank=True, default='')
+    feed_last_modified = models.CharField(max_length=64, blank=True, default='')
+    # set while the feed is being ingested, so overlapping runs for the same supplier are skipped
+    feed_locked_until = models.DateTimeField(null=True, blank=True, editable=False)
+    # feed tag -> SupplierOffer field overrides of the default mapping, see supplies.services.mapping
+    field_mapping = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return self.name
 
 
-class SupplierOffer(models.Model):
+class SupplierOffer(UpdatedAtMixin, models.Model):
     _id = models.BigAutoField(primary_key=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     supplier = models.ForeignKey(Supplier, on_delete=models.DO_NOTHING)
 
     id = models.CharField(max_length=255)
@@ -65,9 +79,13 @@ class SupplierOffer(models.Model):
     keywords = models.JSONField(null=True)
     keywords_ua = models.JSONField(null=True)
     params = models.TextField(null=True)
+    # the same params parsed at ingest: [{"name": ..., "unit": ..., "value": ...}], unit is present only if set
+    param_values = models.JSONField(null=True, blank=True, editable=False)
     pictures = models.JSONField()
     gtin = models.CharField(max_length=64, null=True, blank=True)
     mpn = models.CharField(max_length=64, null=True, blank=True)
+    # hash of the offer data from the last ingested feed, used to skip offers that didn't change
+    digest = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     category = models.ForeignKey(
         'SupplierCategory',
@@ -104,9 +122,12 @@ class SupplierOffer(models.Model):
     class Meta:
         verbose_name = 'Supplier Offer'
         verbose_name_plural = 'Supplier Offers'
+        constraints = [
+            models.UniqueConstraint(fields=['supplier', 'id'], name='unique_supplier_offer_id'),
+        ]
 
 
-class Offer(models.Model):
+class Offer(UpdatedAtMixin, models.Model):
     _id = models.BigAutoField(primary_key=True)
     supplier_offer: SupplierOffer = models.OneToOneField(
         SupplierOffer,
@@ -115,7 +136,7 @@ class Offer(models.Model):
     )
     active = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     group_id = models.BigIntegerField(null=True, blank=True)
     url = models.URLField(null=True, blank=True)
@@ -146,6 +167,15 @@ class Offer(models.Model):
         null=True,
         blank=True
     )
+    # exported price (see `price`), kept in sync by supplies.services.pricing.update_final_prices
+    final_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+    )
 
     @property
     def available(self):
@@ -253,3 +283,122 @@ class SupplierCategory(models.Model, TreeMixin):
 
     def __str__(self):
         return f'{self.supplier} | {self.name}'
+
+
+class PriceRule(models.Model):
+    """
+    Price multiplier for offers of the supplier and/or site category (including its subcategories) whose base price
+    (suggested or supplier price) is within [min_price, max_price). Empty conditions match any offer.
+    When several rules match, the most specific one wins: supplier, then deeper category, then price band.
+    See supplies.services.pricing.
+    """
+    supplier = models.ForeignKey(
+        Supplier, on_delete=models.CASCADE, null=True, blank=True, related_name='price_rules'
+    )
+    site_category = models.ForeignKey(
+        SiteCategory, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='price_rules'
+    )
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    multiplier = models.DecimalField(max_digits=10, decimal_places=2)
+    active = models.BooleanField(default=True)
+
+    def __str__(self):
+        conditions = [str(c) for c in [self.supplier, self.site_category] if c]
+        if self.min_price is not None or self.max_price is not None:
+            conditions.append(f'{self.min_price or 0}-{self.max_price or "..."}')
+        return f'{" | ".join(conditions) or "All offers"}: x{self.multiplier}'
+
+    class Meta:
+        verbose_name = 'Price Rule'
+        verbose_name_plural = 'Price Rules'
+
+
+class ImageTextVerdict(models.Model):
+    """
+    Result of the text detection on the image of Google Merchant Center feed.
+    The image is checked again only if its ETag (or Last-Modified) and content hash changed.
+    See supplies.services.feed.agenerate_merchant_center_xml.
+    """
+    url = models.URLField(max_length=2000, unique=True)
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    # sha256 of the image content
+    content_hash = models.CharField(max_length=64)
+    has_text = models.BooleanField()
+    regions = models.PositiveIntegerField()
+    # when the text detection was run, not changed while the image stays the same
+    checked_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.url
+
+    class Meta:
+        verbose_name = 'Image Text Verdict'
+        verbose_name_plural = 'Image Text Verdicts'
+
+
+class IngestRun(models.Model):
+    STATUS_RUNNING = 'running'
+    STATUS_UPDATED = 'updated'
+    STATUS_NOT_MODIFIED = 'not_modified'
+    STATUS_LOCKED = 'locked'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_UPDATED, 'Updated'),
+        (STATUS_NOT_MODIFIED, 'Not modified'),
+        (STATUS_LOCKED, 'Locked'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    PEAK_RSS_RUN = 'run'
+    PEAK_RSS_PROCESS = 'process'
+    PEAK_RSS_SCOPE_CHOICES = [
+        (PEAK_RSS_RUN, 'Run'),
+        (PEAK_RSS_PROCESS, 'Process lifetime'),
+    ]
+
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='ingest_runs')
+    started_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    error = models.TextField(blank=True)
+
+    bytes_fetched = models.BigIntegerField(default=0)
+    snapshot = models.CharField(max_length=64, blank=True)
+    new_offers = models.PositiveIntegerField(default=0)
+    changed_offers = models.PositiveIntegerField(default=0)
+    unchanged_offers = models.PositiveIntegerField(default=0)
+    vanished_offers = models.PositiveIntegerField(default=0)
+    categories = models.PositiveIntegerField(default=0)
+    orphaned_categories = models.PositiveIntegerField(default=0)
+    # saved categories missing in the feed
+    removed_categories = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+
+    wall_time = models.FloatField(null=True, blank=True)
+    download_time = models.FloatField(null=True, blank=True)
+    parse_time = models.FloatField(null=True, blank=True)
+    categories_time = models.FloatField(null=True, blank=True)
+    upsert_time = models.FloatField(null=True, blank=True)
+    reconcile_time = models.FloatField(null=True, blank=True)
+    # peak resident set size of the worker process in kilobytes, during the run if the peak could be reset
+    # at its start (Linux), otherwise during the whole process lifetime including earlier tasks
+    peak_rss = models.PositiveIntegerField(null=True, blank=True)
+    peak_rss_scope = models.CharField(max_length=16, choices=PEAK_RSS_SCOPE_CHOICES, blank=True)
+
+    @property
+    def offers(self):
+        return self.new_offers + self.changed_offers + self.unchanged_offers
+
+    @property
+    def offers_per_second(self):
+        return round(self.offers / self.wall_time) if self.wall_time else None
+
+    def __str__(self):
+        return f'{self.supplier} | {self.started_at:%Y-%m-%d %H:%M}'
+
+    class Meta:
+        verbose_name = 'Ingest Run'
+        verbose_name_plural = 'Ingest Runs'
+        ordering = ['-started_at']
@@ -0,0 +1,231 @@
+"""
+Materialized offers feed.
+
+The feed is rendered to MEDIA_ROOT/supplies/feed/<digest>/ together with pre-compressed gzip and brotli
+variants. `current` symlink next to the builds is swapped atomically,
+so readers always see a complete set of files. The digest of the content serves as ETag.
+
+Besides the full feed, the same builds are made for shards - offers of one supplier or one top-level site category
+(settings.FEED_SHARD_BY) under MEDIA_ROOT/supplies/feed-shards/<shard>/. Every shard is rebuilt on its own
+when its offers change, so rebuilds are proportional to the change and shards can be rebuilt in parallel.
+Changes of categories may move any offer, so they rebuild all shards and remove the ones left without offers.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Optional, Iterable, List, Set
+
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import QuerySet
+
+from supplies.models import Offer
+from supplies.services.categories import get_category_tree
+from supplies.services.feed import iter_offers_xml
+
+logger = logging.getLogger(__name__)
+
+FEED_FILE_NAME = 'feed.xml'
+CURRENT_BUILD = 'current'
+# previous builds are kept for a while, so responses started before the swap can be finished
+KEEP_BUILDS = 2
+REBUILD_SCHEDULED_KEY = 'supplies:feed-rebuild-scheduled'
+BROTLI_QUALITY = 9
+
+
+def get_feed_dir() -> Path:
+    return Path(settings.MEDIA_ROOT) / 'supplies' / 'feed'
+
+
+def get_shards_dir() -> Path:
+    return Path(settings.MEDIA_ROOT) / 'supplies' / 'feed-shards'
+
+
+def get_shard_dir(shard: str) -> Path:
+    return get_shards_dir() / shard
+
+
+def get_current_build(feed_dir: Path = None) -> Optional[Path]:
+    """
+    :param feed_dir: directory of the full feed (default) or a shard builds
+    :return: directory of the current feed build or None if the feed was never built
+    """
+    current = (feed_dir or get_feed_dir()) / CURRENT_BUILD
+    return current.resolve() if current.exists() else None
+
+
+def get_exported_offers():
+    return Offer.objects.filter(active=True, supplier_offer__available=True)
+
+
+def get_shard_names() -> List[str]:
+    """
+    :return: names of all shards: supplier-<id> or category-<top-level site category id> and category-none
+    """
+    if settings.FEED_SHARD_BY == 'category':
+        return [f'category-{id_}' for id_ in get_category_tree().get_children(None)] + ['category-none']
+    supplier_ids = get_exported_offers().order_by().values_list('supplier_offer__supplier_id', flat=True).distinct()
+    return [f'supplier-{id_}' for id_ in sorted(supplier_ids)]
+
+
+def get_offer_shard_names(offer_queryset: QuerySet[Offer]) -> Set[str]:
+    """
+    :return: names of shards the offers belong to
+    """
+    if settings.FEED_SHARD_BY == 'category':
+        tree = get_category_tree()
+        shards = set()
+        site_category_ids = offer_queryset.order_by().values_list(
+            'supplier_offer__category__site_category_id', flat=True
+        ).distinct()
+        for id_ in site_category_ids:
+            if id_ is None or id_ not in tree:
+                shards.add('category-none')
+            else:
+                shards.add(f'category-{(tree.get_ancestors(id_) or [id_])[-1]}')
+        return shards
+    supplier_ids = offer_queryset.order_by().values_list('supplier_offer__supplier_id', flat=True).distinct()
+    return {f'supplier-{id_}' for id_ in supplier_ids}
+
+
+def get_shard_offers(shard: str) -> QuerySet[Offer]:
+    kind, _, key = shard.partition('-')
+    offers = get_exported_offers()
+    if kind == 'supplier' and key.isdigit():
+        return offers.filter(supplier_offer__supplier_id=int(key))
+    if kind == 'category' and key == 'none':
+        return offers.filter(supplier_offer__category__site_category=None)
+    if kind == 'category' and key.isdigit():
+        site_category_ids = get_category_tree().get_descendants(int(key))
+        return offers.filter(supplier_offer__category__site_category_id__in=site_category_ids)
+    raise ValueError(f'Unknown feed shard {shard}')
+
+
+def build_feed_file(feed_dir: Path = None, offer_queryset: QuerySet[Offer] = None) -> Path:
+    """
+    Renders offers feed and its compressed variants and makes them current
+    :param feed_dir: directory of the builds, the full feed directory by default
+    :param offer_queryset: exported offers, all by default
+    :return: directory of the new build
+    """
+    feed_dir = feed_dir or get_feed_dir()
+    offer_queryset = get_exported_offers() if offer_queryset is None else offer_queryset
+    build_dir = feed_dir / f'.build-{os.getpid()}'
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+
+    sha256 = hashlib.sha256()
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    with ExitStack() as stack:
+        xml_file = stack.enter_context(open(build_dir / FEED_FILE_NAME, 'wb'))
+        gz_file = stack.enter_context(gzip.open(build_dir / f'{FEED_FILE_NAME}.gz', 'wb', compresslevel=9))
+        br_file = stack.enter_context(open(build_dir / f'{FEED_FILE_NAME}.br', 'wb'))
+
+        for chunk in iter_offers_xml(offer_queryset):
+            sha256.update(chunk)
+            xml_file.write(chunk)
+            gz_file.write(chunk)
+            br_file.write(compressor.process(chunk))
+        br_file.write(compressor.finish())
+
+    digest = sha256.hexdigest()
+    target_dir = feed_dir / digest
+    if target_dir.exists():
+        # nothing changed since the build with the same content, only missing variants are added
+        for path in build_dir.iterdir():
+            if not (target_dir / path.name).exists():
+                os.replace(path, target_dir / path.name)
+        shutil.rmtree(build_dir)
+    else:
+        os.replace(build_dir, target_dir)
+
+    tmp_link = feed_dir / f'.{CURRENT_BUILD}-{os.getpid()}'
+    if tmp_link.is_symlink():
+        tmp_link.unlink()
+    tmp_link.symlink_to(digest)
+    os.replace(tmp_link, feed_dir / CURRENT_BUILD)
+
+    prune_builds(target_dir)
+    return target_dir
+
+
+def build_feed_shard(shard: str) -> Optional[Path]:
+    """
+    :return: directory of the new build, None if the shard doesn't exist anymore and its builds are removed
+    """
+    if shard not in get_shard_names():
+        shutil.rmtree(get_shard_dir(shard), ignore_errors=True)
+        return None
+    return build_feed_file(get_shard_dir(shard), get_shard_offers(shard))
+
+
+def prune_shards() -> List[str]:
+    """
+    Removes builds of shards which don't exist anymore (e.g. all offers of the supplier are unpublished)
+    :return: names of the removed shards
+    """
+    if not get_shards_dir().exists():
+        return []
+    shards = set(get_shard_names())
+    removed = [p.name for p in get_shards_dir().iterdir() if p.is_dir() and p.name not in shards]
+    for name in removed:
+        shutil.rmtree(get_shard_dir(name), ignore_errors=True)
+    return removed
+
+
+def get_shards_index() -> List[dict]:
+    """
+    :return: name, digest, size and build time of every built shard
+    """
+    index = []
+    shards_dir = get_shards_dir()
+    for shard_dir in sorted(shards_dir.iterdir()) if shards_dir.exists() else []:
+        build_dir = get_current_build(shard_dir)
+        if build_dir is None:
+            continue
+        stat = (build_dir / FEED_FILE_NAME).stat()
+        index.append({
+            'name': shard_dir.name,
+            'sha256': build_dir.name,
+            'size': stat.st_size,
+            'built_at': stat.st_mtime,
+        })
+    return index
+
+
+def prune_builds(current: Path):
+    builds = sorted(
+        (p for p in current.parent.iterdir() if p.is_dir() and not p.is_symlink() and not p.name.startswith('.')),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True
+    )
+    for path in [p for p in builds if p != current][KEEP_BUILDS - 1:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def schedule_feed_rebuild(shards: Iterable[str] = None):
+    """
+    Schedules rebuild of the feed and its shards in settings.FEED_REBUILD_DELAY seconds, changes made meanwhile
+    are picked up by the same rebuild. Scheduled rebuilds are marked in the shared default cache,
+    so web and worker processes don't schedule their own ones.
+    :param shards: names of the changed shards (including the ones offers left),
+        all shards are rebuilt and the ones which don't exist anymore are removed if not provided
+    """
+    from supplies.tasks import rebuild_feed, rebuild_feed_shard, rebuild_feed_shards
+
+    if cache.add(REBUILD_SCHEDULED_KEY, True, timeout=settings.FEED_REBUILD_DELAY):
+        rebuild_feed.apply_async(countdown=settings.FEED_REBUILD_DELAY)
+
+    if shards is None:
+        if cache.add(f'{REBUILD_SCHEDULED_KEY}:*', True, timeout=settings.FEED_REBUILD_DELAY):
+            rebuild_feed_shards.apply_async(countdown=settings.FEED_REBUILD_DELAY)
+        return
+
+    for shard in shards:
+        if cache.add(f'{REBUILD_SCHEDULED_KEY}:{shard}', True, timeout=settings.FEED_REBUILD_DELAY):
+            rebuild_feed_shard.apply_async(args=[shard], countdown=settings.FEED_REBUILD_DELAY)
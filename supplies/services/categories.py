@@ -0,0 +1,102 @@
+"""
+Process-local cache of category trees.
+
+SiteCategory and SupplierCategory trees are loaded with one query each and kept in memory of the process.
+Every tree has a version stored in the default cache, which is shared by web and worker processes (redis or
+the database, see CACHES setting). `invalidate_category_tree` changes it, so all processes reload the tree
+on the next access. A version lost by the cache is replaced with a new one, which only causes an extra reload.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional, Type
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import models
+
+from supplies.models import SiteCategory
+
+CATEGORY_TREE_VERSION_KEY = 'supplies:category-tree-version:{}'
+
+# model label -> (version, tree)
+_trees: Dict[str, tuple] = {}
+
+
+class CategoryTree:
+    def __init__(self, rows):
+        """
+        :param rows: (id, parent id, name) of every category
+        """
+        self.names: Dict[int, str] = {}
+        self.parents: Dict[int, Optional[int]] = {}
+        self.children: Dict[Optional[int], List[int]] = defaultdict(list)
+        for id_, parent_id, name in rows:
+            self.names[id_] = name
+            self.parents[id_] = parent_id
+            self.children[parent_id].append(id_)
+        # values derived from the tree (e.g. rendered feed parts), dropped together with it
+        self.memo = {}
+
+    def __contains__(self, id_):
+        return id_ in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_parent(self, id_) -> Optional[int]:
+        return self.parents.get(id_)
+
+    def get_children(self, id_) -> List[int]:
+        return self.children.get(id_, [])
+
+    def get_descendants(self, id_, include_self=True) -> List[int]:
+        result = [id_] if include_self else []
+        stack = list(self.get_children(id_))
+        seen = {id_}
+        while stack:
+            child = stack.pop()
+            if child in seen:
+                continue
+            seen.add(child)
+            result.append(child)
+            stack.extend(self.get_children(child))
+        return result
+
+    def get_ancestors(self, id_) -> List[int]:
+        """
+        :return: ids of the parent, grandparent and so on up to the root
+        """
+        result = []
+        parent_id = self.get_parent(id_)
+        while parent_id is not None and parent_id not in result and parent_id != id_:
+            result.append(parent_id)
+            parent_id = self.get_parent(parent_id)
+        return result
+
+
+def get_category_tree(model: Type[models.Model] = SiteCategory) -> CategoryTree:
+    """
+    :param model: SiteCategory or SupplierCategory
+    :return: the tree loaded by this process, reloaded if it was invalidated since then
+    """
+    label = model._meta.label
+    version_key = CATEGORY_TREE_VERSION_KEY.format(label)
+    version = cache.get(version_key)
+    if version is None:
+        # several processes may get here at once, all of them should end up with the same version
+        cache.add(version_key, uuid4().hex, timeout=None)
+        version = cache.get(version_key)
+
+    cached_version, tree = _trees.get(label, (None, None))
+    if cached_version != version:
+        tree = CategoryTree(model.objects.values_list('pk', 'parent_category_id', 'name'))
+        _trees[label] = (version, tree)
+    return tree
+
+
+def invalidate_category_tree(model: Type[models.Model] = SiteCategory):
+    cache.set(CATEGORY_TREE_VERSION_KEY.format(model._meta.label), uuid4().hex, timeout=None)
+    _trees.pop(model._meta.label, None)
+
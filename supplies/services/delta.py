@@ -0,0 +1,124 @@
+"""
+Delta feed: offers whose Offer or SupplierOffer changed since a timestamp.
+
+Marketplace imports that only sync prices and stock (e.g. Prom import with `updated_fields`) don't need
+the full catalog. Every delta response comes with a cursor, passing it as `since` to the next request returns
+offers changed after the previous one. Cursors overlap by DELTA_CURSOR_OVERLAP, so changes committed
+by long transactions are not lost, the price is that some offers are sent twice.
+"""
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from lxml import etree as ET
+
+from supplies.models import Offer
+from supplies.services.feed import (
+    OFFER_EXPORT_COLUMNS, offer_row_to_data, build_offer_element, iter_chunks, drain, FEED_EXPORT_FLUSH_SIZE
+)
+
+# fields which can be requested from the delta feed, `available` is the offer presence
+DELTA_FIELDS = ['available', 'price', 'oldprice', 'price_old', 'discount', 'quantity_in_stock', 'stock_quantity']
+DEFAULT_DELTA_FIELDS = ['available', 'price', 'quantity_in_stock', 'discount']
+DELTA_CURSOR_OVERLAP = timedelta(minutes=1)
+DELTA_CURSOR_SALT = 'supplies.delta-feed'
+
+
+class InvalidDeltaRequest(ValueError):
+    pass
+
+
+def make_cursor(moment: datetime) -> str:
+    return signing.dumps(moment.isoformat(), salt=DELTA_CURSOR_SALT)
+
+
+def parse_since(value: str) -> datetime:
+    """
+    :param value: cursor returned by the previous delta request or ISO 8601 timestamp
+    :raises InvalidDeltaRequest: if the value is neither
+    """
+    try:
+        value = signing.loads(value, salt=DELTA_CURSOR_SALT)
+    except signing.BadSignature:
+        pass
+
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise InvalidDeltaRequest(f'Invalid cursor or timestamp: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_fields(value: Optional[str]) -> Tuple[str, ...]:
+    if not value:
+        return tuple(DEFAULT_DELTA_FIELDS)
+    fields = tuple(f.strip() for f in value.split(',') if f.strip())
+    unknown = set(fields) - set(DELTA_FIELDS)
+    if unknown:
+        raise InvalidDeltaRequest(f'Unknown fields: {", ".join(sorted(unknown))}, allowed: {", ".join(DELTA_FIELDS)}')
+    return fields
+
+
+def get_changed_offer_ids(since: datetime) -> QuerySet:
+    """
+    Offers changed by themselves and offers whose supplier offers changed are selected separately,
+    so both queries are range scans of the updated_at indexes
+    """
+    return Offer.objects.filter(updated_at__gt=since).values_list('pk', flat=True).union(
+        Offer.objects.filter(supplier_offer__updated_at__gt=since).values_list('pk', flat=True)
+    ).order_by('pk')
+
+
+def build_delta_offer_element(row, fields: Iterable[str]) -> ET._Element:
+    offer_data = offer_row_to_data(row)
+    attrs = {'id': offer_data['_attrs']['id']}
+    if 'available' in fields:
+        # unpublished offers are reported as unavailable, so they are hidden by the import
+        active = row[-1]
+        attrs['available'] = 'true' if active and offer_data['_attrs'].get('available') == 'true' else 'false'
+    return build_offer_element({
+        **{k: v for k, v in offer_data.items() if k in fields},
+        '_attrs': attrs,
+    })
+
+
+def iter_delta_xml(since: datetime, fields: Iterable[str] = DEFAULT_DELTA_FIELDS, chunk_size: int = None):
+    """
+    Renders YML feed with only `fields` of the offers changed since `since`
+    :return: iterator of encoded feed parts
+    """
+    chunk_size = chunk_size or settings.FEED_EXPORT_CHUNK_SIZE
+    buffer = BytesIO()
+
+    with ET.xmlfile(buffer, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('yml_catalog', date=timezone.localtime().strftime('%Y-%m-%d %H:%M')):
+            with xf.element('shop'):
+                with xf.element('offers'):
+                    for ids in iter_chunks(get_changed_offer_ids(since).iterator(chunk_size=chunk_size), chunk_size):
+                        rows = Offer.objects.filter(pk__in=ids).order_by('pk').values_list(
+                            *OFFER_EXPORT_COLUMNS, 'active'
+                        )
+                        for row in rows:
+                            xf.write(build_delta_offer_element(row, fields))
+                        if buffer.tell() >= FEED_EXPORT_FLUSH_SIZE:
+                            xf.flush()
+                            yield drain(buffer)
+
+    yield drain(buffer)
+
+
+def get_next_cursor() -> str:
+    """
+    :return: cursor for the delta request started now
+    """
+    return make_cursor(timezone.now() - DELTA_CURSOR_OVERLAP)
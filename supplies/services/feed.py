@@ -1,10 +1,23 @@
 import asyncio
+import hashlib
 import json
 import logging
 import math
 import os
-from typing import List, Dict
-
+import tempfile
+import time
+from collections import defaultdict, deque
+from itertools import islice
+from contextlib import contextmanager, asynccontextmanager
+from datetime import timedelta
+from io import BytesIO
+from typing import List, Dict, Optional, Set, Tuple
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import billiard
+import django
+import httpx
 from bs4 import BeautifulSoup
 from lxml import etree as ET
 
@@ -13,16 +26,31 @@ import numpy as np
 import requests
 from _decimal import Decimal
 from django.conf import settings
-from django.core.serializers import serialize
-from django.db.models import QuerySet
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.db.models import QuerySet, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
 from requests import HTTPError
 from retry import retry
 
-from supplies.models import SiteCategory, Offer, SupplierCategory, SupplierOffer, Supplier
+from supplies.dto import OffersIngestStats
+from supplies.models import SiteCategory, Offer, SupplierCategory, SupplierOffer, Supplier, ImageTextVerdict
+from supplies.services.categories import get_category_tree, invalidate_category_tree
+from supplies.services.pricing import update_final_prices
+from supplies.services.mapping import Handler, compile_field_mapping, get_field_mapping
+from supplies.services.snapshots import archive_feed
 from supplies.services.images import TextDetector, swt_text_detection
 
 logger = logging.getLogger(__name__)
 
+# size of rendered feed collected before it's sent to the client
+FEED_EXPORT_FLUSH_SIZE = 64 * 1024
+
+
+class FeedLocked(Exception):
+    pass
+
 
 def insert_elements(source_root, target_root):
     for element in source_root:
@@ -38,15 +66,6 @@ def insert_elements(source_root, target_root):
         target_root.append(new_element)
 
 
-def model_to_json(model, exclude_fields = None):
-    exclude_fields = exclude_fields or []
-    json_data = serialize('json', [model])
-    return {
-        k: v for k, v in json.loads(json_data)[0]['fields'].items()
-        if k not in exclude_fields
-    }
-
-
 def replace_symbols(input_text):
     replacements = {
         '"': '&quot;',
@@ -62,95 +81,189 @@ def replace_symbols(input_text):
     return input_text
 
 
-def get_offers_data(offer_queryset):
-    exclude_fields = ['_id', 'supplier', 'created_at', 'updated_at', 'optPrice', 'category', 'id']
+# SupplierOffer fields exported to the feed, in the order of the model
+SUPPLIER_OFFER_EXPORT_FIELDS = [
+    f.name for f in SupplierOffer._meta.local_fields
+    if f.name not in [
+        '_id', 'supplier', 'created_at', 'updated_at', 'optPrice', 'category', 'id', 'digest', 'param_values'
+    ]
+]
+# Offer fields overriding the same SupplierOffer fields
+OFFER_OVERRIDE_FIELDS = [f.name for f in Offer._meta.local_fields if f.name in SUPPLIER_OFFER_EXPORT_FIELDS]
+
+OFFER_EXPORT_COLUMNS = [
+    'pk',
+    'suggested_price',
+    'price_multiplier',
+    'supplier_offer__category__site_category',
+    *OFFER_OVERRIDE_FIELDS,
+    *[f'supplier_offer__{f}' for f in SUPPLIER_OFFER_EXPORT_FIELDS],
+    'supplier_offer__param_values',
+]
+# (field name, index of supplier offer value, index of offer value or None) for every exported field
+OFFER_EXPORT_FIELD_INDEXES = [
+    (
+        f,
+        OFFER_EXPORT_COLUMNS.index(f'supplier_offer__{f}'),
+        OFFER_EXPORT_COLUMNS.index(f) if f in OFFER_OVERRIDE_FIELDS else None
+    )
+    for f in SUPPLIER_OFFER_EXPORT_FIELDS
+]
+SUPPLIER_PRICE_INDEX = OFFER_EXPORT_COLUMNS.index('supplier_offer__price')
+PARAM_VALUES_INDEX = OFFER_EXPORT_COLUMNS.index('supplier_offer__param_values')
+# columns the version of the rendered offer is derived from (see `offer_fragment_version`)
+OFFER_VERSION_COLUMNS = ['pk', 'updated_at', 'supplier_offer__updated_at', 'supplier_offer__category__site_category']
 
-    offers = []
-    for offer in offer_queryset:
-        offer_result = {}
-        offer_data = model_to_json(offer)
-        supplier_offer_data = model_to_json(offer.supplier_offer, exclude_fields)
-        attrs = {'id': str(offer.pk)}
-
-        category = offer.supplier_offer.category
-        if category and category.site_category:
-            offer_result['categoryId'] = category.site_category.id
-
-        for k, v in supplier_offer_data.items():
-            if k in ['keywords', 'keywords_ua'] and (v or offer_data.get(v, None)):
-                val = ', '.join((v or []) + (offer_data.get(k, []) or []))
-            elif k == 'price':
-                val = math.ceil(offer.price)
-            elif k in ['oldprice', 'price_old', 'discount'] and v and offer.price_multiplier:
-                v = Decimal(v)
-                val = math.ceil(v * offer.price_multiplier)
-                if k in ['oldprice', 'price_old'] and v < offer.price:
-                    # using 30% discount as fallback if supplier data has wrong old price
-                    val = math.ceil(v + v * Decimal(0.3))
-            elif isinstance(v, bool):
-                val = str(offer_data.get(k, v)).lower()
-            elif k == 'pictures':
-                val = (offer_data.get(k, []) or []) + (v or [])
-            elif (offer_data.get(k, v) or v) is not None:
-                val = str(offer_data.get(k, v) or v)
-            else:
-                continue
 
-            if k in ['id', 'available', 'group_id']:
-                attrs[k] = val
-            else:
-                offer_result[k] = val
+def iter_offer_rows(offer_queryset: QuerySet[Offer], chunk_size: int = None):
+    """
+    Fetches exported columns of offers, their supplier offers and site categories with one joined query
+    :return: iterator of tuples ordered as OFFER_EXPORT_COLUMNS
+    """
+    return offer_queryset.values_list(*OFFER_EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
 
-        offer_result = {
-            k: v for k, v in offer_result.items()
-            if k not in attrs
-        }
 
-        offer_result['_attrs'] = attrs
+def offer_row_to_data(row) -> Dict:
+    """
+    Merges offer with its supplier offer. Offer values take precedence, prices are recalculated with the multiplier
+    """
+    pk, suggested_price, price_multiplier, site_category_id = row[:4]
+    price = (suggested_price or row[SUPPLIER_PRICE_INDEX]) * (price_multiplier or 1)
+
+    offer_result = {}
+    attrs = {'id': str(pk)}
+
+    if site_category_id:
+        offer_result['categoryId'] = site_category_id
+
+    for k, supplier_index, offer_index in OFFER_EXPORT_FIELD_INDEXES:
+        v = row[supplier_index]
+        if isinstance(v, Decimal):
+            v = str(v)
+        own_value = row[offer_index] if offer_index is not None else None
+        value = own_value if offer_index is not None else v
+
+        if k in ['keywords', 'keywords_ua'] and (v or own_value):
+            val = ', '.join((v or []) + (own_value or []))
+        elif k == 'price':
+            val = math.ceil(price)
+        elif k in ['oldprice', 'price_old', 'discount'] and v and price_multiplier:
+            v = Decimal(v)
+            val = math.ceil(v * price_multiplier)
+            if k in ['oldprice', 'price_old'] and v < price:
+                # using 30% discount as fallback if supplier data has wrong old price
+                val = math.ceil(v + v * Decimal(0.3))
+        elif isinstance(v, bool):
+            val = str(value).lower()
+        elif k == 'pictures':
+            val = (own_value or []) + (v or [])
+        elif k == 'params' and not own_value and row[PARAM_VALUES_INDEX] is not None:
+            # offers ingested before params were parsed have only the text
+            val = row[PARAM_VALUES_INDEX]
+        elif (value or v) is not None:
+            val = str(value or v)
+        else:
+            continue
+
+        if k in ['id', 'available', 'group_id']:
+            attrs[k] = val
+        else:
+            offer_result[k] = val
+
+    offer_result = {
+        k: v for k, v in offer_result.items()
+        if k not in attrs
+    }
 
-        offers.append(offer_result)
-    return offers
+    offer_result['_attrs'] = attrs
+    return offer_result
 
 
-def gen_xml(offers_data: List[Dict]):
-    root = ET.Element("yml_catalog")
-    shop = ET.SubElement(root, "shop")
-    ET.SubElement(shop, "name").text = "111"  # You can fill in the shop details accordingly
-    ET.SubElement(shop, "company").text = "111"
-    ET.SubElement(shop, "url").text = "111"
-    currencies = ET.SubElement(shop, "currencies")
+def iter_offers_data(offer_queryset: QuerySet[Offer], chunk_size: int = None):
+    for row in iter_offer_rows(offer_queryset, chunk_size):
+        yield offer_row_to_data(row)
+
+
+def get_offers_data(offer_queryset: QuerySet[Offer]) -> List[Dict]:
+    return list(iter_offers_data(offer_queryset))
+
+
+FEED_DOCTYPE = '<!DOCTYPE yml_catalog SYSTEM "shops.dtd">'
+
+
+def build_shop_elements() -> List[ET._Element]:
+    elements = []
+    for tag in ['name', 'company', 'url']:
+        el = ET.Element(tag)
+        el.text = "111"  # You can fill in the shop details accordingly
+        elements.append(el)
+    currencies = ET.Element("currencies")
     ET.SubElement(currencies, "currency", id='UAH', rate='1')
-    categories = ET.SubElement(shop, "categories")
-    offers = ET.SubElement(shop, "offers")
+    elements.append(currencies)
+    return elements
 
-    categories_qs = SiteCategory.objects.all()
 
-    for c in categories_qs:
-        attrs = {'id': str(c.id)}
-        if c.parent_category:
-            attrs['parentId'] = str(c.parent_category.id)
+def build_categories_element() -> ET._Element:
+    tree = get_category_tree(SiteCategory)
+    categories = ET.Element("categories")
+    for id_ in tree:
+        attrs = {'id': str(id_)}
+        if tree.get_parent(id_):
+            attrs['parentId'] = str(tree.get_parent(id_))
         category = ET.SubElement(
             categories, "category",
             attrib=attrs
         )
-        category.text = c.name
+        category.text = tree.names[id_]
+    return categories
+
+
+def render_categories_fragment() -> bytes:
+    """
+    :return: rendered <categories> element, computed once per version of the site category tree
+    """
+    tree = get_category_tree(SiteCategory)
+    if 'feed_categories' not in tree.memo:
+        tree.memo['feed_categories'] = ET.tostring(build_categories_element(), encoding='utf-8')
+    return tree.memo['feed_categories']
+
+
+def build_offer_element(offer_data: Dict) -> ET._Element:
+    offer_el = ET.Element("offer", attrib=offer_data['_attrs'])
+    for field, value in offer_data.items():
+        if field == '_attrs':
+            continue
+        elif field == 'params' and isinstance(value, list):
+            for param in value:
+                ET.SubElement(
+                    offer_el, 'param', attrib={k: v for k, v in param.items() if k != 'value' and v is not None}
+                ).text = param['value']
+        elif field == 'params':
+            # manually edited Offer.params override the supplier params as raw XML
+            params_root = ET.fromstring(f'<root>{value}</root>')
+            insert_elements(params_root, offer_el)
+        elif field in ['keywords', 'keywords_ua'] and value:
+            ET.SubElement(offer_el, field).text = value
+        elif field == 'pictures':
+            for url in value[:10]:
+                ET.SubElement(offer_el, 'picture').text = str(url)
+        elif field in ['description', 'description_ua']:
+            ET.SubElement(offer_el, field).text = ET.CDATA(value.replace('\n', '<br/>'))
+        else:
+            ET.SubElement(offer_el, field).text = str(value)
+    return offer_el
+
+
+def gen_xml(offers_data: List[Dict]):
+    root = ET.Element("yml_catalog")
+    shop = ET.SubElement(root, "shop")
+    shop.extend(build_shop_elements())
+    shop.append(build_categories_element())
+    offers = ET.SubElement(shop, "offers")
 
     for o in offers_data:
-        offer_el = ET.SubElement(offers, "offer", attrib=o.pop('_attrs'))
-        for field, value in o.items():
-            if field == 'params':
-                params_root = ET.fromstring(f'<root>{value}</root>')
-                insert_elements(params_root, offer_el)
-            elif field in ['keywords', 'keywords_ua'] and value:
-                ET.SubElement(offer_el, field).text = value
-            elif field == 'pictures':
-                for url in value[:10]:
-                    ET.SubElement(offer_el, 'picture').text = str(url)
-            elif field in ['description', 'description_ua']:
-                ET.SubElement(offer_el, field).text = ET.CDATA(value.replace('\n', '<br/>'))
-            else:
-                ET.SubElement(offer_el, field).text = str(value)
-    return ('<?xml version="1.0" encoding="UTF-8" ?><!DOCTYPE yml_catalog SYSTEM "shops.dtd">' +
+        offers.append(build_offer_element(o))
+    return ('<?xml version="1.0" encoding="UTF-8" ?>' + FEED_DOCTYPE +
             ET.tostring(root, encoding="utf-8").decode("utf-8"))
 
 
@@ -158,81 +271,570 @@ def generate_offers_xml(offer_queryset: QuerySet[Offer]):
     return gen_xml(get_offers_data(offer_queryset))
 
 
-def save_offers(xml_data, supplier):
-    # Parse XML
-    root = ET.fromstring(xml_data)
-    existing_categories = SupplierCategory.objects.filter(supplier=supplier).values_list('pk', flat=True)
-
-    categories = []
-    for category_element in root.findall(".//categories/category"):
-        categories.append(SupplierCategory(
-            id=category_element.get('id'),
-            supplier=supplier,
-            parent_category_id=category_element.get('parentId'),
-            name=category_element.text
-        ))
-    categories = filter(  # removing categories with invalid parents
-        lambda x: x.parent_category_id in list(map(lambda c: c.id, categories)) + list(existing_categories),
-        categories
+# bump when rendering of <offer> changes, so fragments cached by the previous code are not used
+OFFER_FRAGMENT_FORMAT = 2
+OFFER_FRAGMENT_KEY = 'supplies:offer-xml:{}:{}'
+# generation is a part of fragment keys, changing it evicts all fragments without flushing the cache
+OFFER_FRAGMENT_GENERATION_KEY = 'supplies:offer-xml-generation'
+# fragments of evicted generations and of offers not rendered for this long expire
+OFFER_FRAGMENT_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def get_fragment_cache():
+    return caches[settings.FEED_FRAGMENT_CACHE]
+
+
+def get_fragment_generation() -> str:
+    cache = get_fragment_cache()
+    generation = cache.get(OFFER_FRAGMENT_GENERATION_KEY)
+    if generation is None:
+        # several processes may get here at once, all of them should end up with the same generation
+        cache.add(OFFER_FRAGMENT_GENERATION_KEY, uuid4().hex, timeout=None)
+        generation = cache.get(OFFER_FRAGMENT_GENERATION_KEY)
+    return generation
+
+
+def offer_fragment_version(version_row) -> str:
+    """
+    Rendered offer depends on the offer, its supplier offer and the site category the supplier category is mapped to.
+    Both models bump updated_at on every save, partial ones included (see UpdatedAtMixin), so the version changes
+    whenever the rendered fragment may change.
+    :param version_row: tuple ordered as OFFER_VERSION_COLUMNS
+    """
+    _, updated_at, supplier_offer_updated_at, site_category_id = version_row
+    return ':'.join([
+        str(OFFER_FRAGMENT_FORMAT), updated_at.isoformat(), supplier_offer_updated_at.isoformat(), str(site_category_id)
+    ])
+
+
+def lookup_offer_fragments(version_rows) -> Tuple[Dict[int, bytes], Dict[int, str]]:
+    """
+    Looks up cached <offer> fragments of the offers with one cache request
+    :param version_rows: tuples ordered as OFFER_VERSION_COLUMNS
+    :return: up-to-date cached fragments and versions of missing or outdated offers, both by offer pk
+    """
+    generation = get_fragment_generation()
+    cached = get_fragment_cache().get_many([OFFER_FRAGMENT_KEY.format(generation, row[0]) for row in version_rows])
+
+    fragments = {}
+    outdated = {}
+    for row in version_rows:
+        version = offer_fragment_version(row)
+        cached_version, fragment = cached.get(OFFER_FRAGMENT_KEY.format(generation, row[0]), (None, None))
+        if cached_version == version:
+            fragments[row[0]] = fragment
+        else:
+            outdated[row[0]] = version
+    return fragments, outdated
+
+
+def render_offers(offer_ids: List[int]) -> Dict[int, bytes]:
+    """
+    Fetches offers with all exported columns and renders their <offer> elements, doesn't touch the fragment cache,
+    so it can run in a worker process
+    :return: offer pk -> fragment, offers deleted meanwhile are missing
+    """
+    return {
+        row[0]: ET.tostring(build_offer_element(offer_row_to_data(row)), encoding='utf-8')
+        for row in Offer.objects.filter(pk__in=offer_ids).values_list(*OFFER_EXPORT_COLUMNS)
+    }
+
+
+def store_offer_fragments(rendered: Dict[int, bytes], versions: Dict[int, str]):
+    generation = get_fragment_generation()
+    get_fragment_cache().set_many(
+        {OFFER_FRAGMENT_KEY.format(generation, pk): (versions[pk], fragment) for pk, fragment in rendered.items()},
+        timeout=OFFER_FRAGMENT_TIMEOUT,
     )
 
+
+def join_offer_fragments(version_rows, fragments: Dict[int, bytes]) -> bytes:
+    # offers deleted between the queries are skipped
+    return b''.join(fragments[row[0]] for row in version_rows if row[0] in fragments)
+
+
+def render_offer_fragments(version_rows) -> bytes:
+    """
+    Renders <offer> elements of the offers, in the order of `version_rows` (tuples ordered as OFFER_VERSION_COLUMNS).
+    Fragments are looked up in the cache with one request, only missing or outdated offers are fetched
+    with all exported columns, rendered and stored back.
+    """
+    fragments, outdated = lookup_offer_fragments(version_rows)
+    if outdated:
+        rendered = render_offers(list(outdated))
+        store_offer_fragments(rendered, outdated)
+        fragments.update(rendered)
+    return join_offer_fragments(version_rows, fragments)
+
+
+def evict_offer_fragments(offer_ids=None):
+    """
+    Removes cached <offer> fragments of the offers, all of them if `offer_ids` is None.
+    Required after queryset.update() calls, which bypass signals and don't bump updated_at.
+    All fragments are evicted by starting a new generation, the cache itself is not flushed since it may be
+    shared with other data.
+    """
+    cache = get_fragment_cache()
+    if offer_ids is None:
+        cache.set(OFFER_FRAGMENT_GENERATION_KEY, uuid4().hex, timeout=None)
+    else:
+        generation = get_fragment_generation()
+        cache.delete_many([OFFER_FRAGMENT_KEY.format(generation, pk) for pk in offer_ids])
+
+
+def iter_chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def drain(buffer: BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def render_offers_in_worker(offer_ids: List[int], database_names: Dict[str, str]) -> Dict[int, bytes]:
+    """
+    Runs `render_offers` in a pool worker. Workers are spawned with a fresh interpreter set up by `django.setup`
+    initializer, so they don't share database connections of the parent.
+    :param database_names: alias -> database name of the parent, which may differ from settings (e.g. test database)
+    """
+    for alias, name in database_names.items():
+        connections[alias].settings_dict['NAME'] = name
+    return render_offers(offer_ids)
+
+
+def iter_offer_chunks(offer_queryset: QuerySet[Offer], chunk_size: int):
+    """
+    :return: iterator of rendered chunks of `chunk_size` offers
+    """
+    version_rows = offer_queryset.values_list(*OFFER_VERSION_COLUMNS).iterator(chunk_size=chunk_size)
+    for rows in iter_chunks(version_rows, chunk_size):
+        yield render_offer_fragments(rows)
+
+
+def iter_offer_chunks_parallel(offer_queryset: QuerySet[Offer], chunk_size: int, workers: int):
+    """
+    Renders outdated offers of every chunk of `chunk_size` offers in a pool of `workers` processes.
+    The fragment cache is used by this process only: workers return rendered fragments, which are stored here,
+    so they are cached even if the fragment cache is local to the process.
+    billiard pool is used since it can be started from daemonic Celery prefork workers.
+    :return: iterator of rendered chunks in the order of the queryset
+    """
+    version_rows = offer_queryset.values_list(*OFFER_VERSION_COLUMNS).iterator(chunk_size=chunk_size)
+    database_names = {conn.alias: conn.settings_dict['NAME'] for conn in connections.all()}
+    context = billiard.get_context('spawn')
+
+    # the initializer can't come from this module, it can't be imported before django is set up
+    with context.Pool(workers, initializer=django.setup) as pool:
+        # only a few chunks per worker are queued, so rendered chunks don't pile up in memory
+        pending = deque()
+
+        def finish_chunk():
+            rows, fragments, outdated, result = pending.popleft()
+            if result is not None:
+                rendered = result.get()
+                store_offer_fragments(rendered, outdated)
+                fragments.update(rendered)
+            return join_offer_fragments(rows, fragments)
+
+        for rows in iter_chunks(version_rows, chunk_size):
+            fragments, outdated = lookup_offer_fragments(rows)
+            result = pool.apply_async(render_offers_in_worker, (list(outdated), database_names)) if outdated else None
+            pending.append((rows, fragments, outdated, result))
+            if len(pending) >= workers * 2:
+                yield finish_chunk()
+        while pending:
+            yield finish_chunk()
+
+
+def iter_offers_xml(offer_queryset: QuerySet[Offer], chunk_size: int = None, workers: int = None):
+    """
+    Incrementally renders offers feed, the same as `generate_offers_xml` does.
+    Offers are fetched from the database in chunks of `chunk_size` (settings.FEED_EXPORT_CHUNK_SIZE by default)
+    and written as soon as they are rendered, so memory usage doesn't depend on the catalog size.
+    Offers that haven't changed since the previous export are taken from the fragment cache.
+    :param workers: number of processes rendering offers (settings.FEED_EXPORT_WORKERS by default),
+        chunks are rendered in the same process if it's 1
+    :return: iterator of encoded feed parts
+    """
+    chunk_size = chunk_size or settings.FEED_EXPORT_CHUNK_SIZE
+    workers = workers or settings.FEED_EXPORT_WORKERS
+    buffer = BytesIO()
+
+    with ET.xmlfile(buffer, encoding='utf-8') as xf:
+        xf.write_declaration(doctype=FEED_DOCTYPE)
+        with xf.element('yml_catalog'):
+            with xf.element('shop'):
+                for el in build_shop_elements():
+                    xf.write(el)
+                xf.flush()
+                buffer.write(render_categories_fragment())
+                yield drain(buffer)
+
+                with xf.element('offers'):
+                    # cached fragments are written to the buffer directly, past the flushed serializer state
+                    xf.flush()
+                    if workers > 1:
+                        chunks = iter_offer_chunks_parallel(offer_queryset, chunk_size, workers)
+                    else:
+                        chunks = iter_offer_chunks(offer_queryset, chunk_size)
+                    for chunk in chunks:
+                        buffer.write(chunk)
+                        if buffer.tell() >= FEED_EXPORT_FLUSH_SIZE:
+                            yield drain(buffer)
+
+    yield drain(buffer)
+
+
+def iter_feed_elements(source):
+    """
+    Streams <category> and <offer> elements of a YML feed as soon as they are parsed.
+    Every yielded element is cleared (together with already processed siblings) once the consumer is done with it,
+    so memory usage doesn't depend on the feed size.
+    :param source: file name or file-like object with the feed
+    """
+    context = ET.iterparse(source, events=('end',), tag=('category', 'offer'), huge_tree=True)
+    for _, element in context:
+        yield element
+
+        element.clear(keep_tail=True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def sync_categories(categories: Dict[int, Tuple[Optional[int], str]], supplier: Supplier,
+                    stats: OffersIngestStats) -> Set[int]:
+    """
+    Upserts supplier category tree from the feed in one statement.
+    Categories are saved in topological order (parents first). Categories whose parent is neither in the feed
+    nor already saved are orphaned and skipped, saved categories missing in the feed are kept since offers
+    still can reference them. Both are reported to the stats.
+    :param categories: category id -> (parent category id, name)
+    :return: ids of all supplier categories which offers can reference
+    """
+    existing = set(SupplierCategory.objects.filter(supplier=supplier).values_list('pk', flat=True))
+
+    children = defaultdict(list)
+    roots = []
+    for id_, (parent_id, _) in categories.items():
+        if parent_id is None or (parent_id not in categories and parent_id in existing):
+            roots.append(id_)
+        else:
+            children[parent_id].append(id_)
+
+    ordered = []
+    queue = deque(roots)
+    while queue:
+        id_ = queue.popleft()
+        ordered.append(id_)
+        queue.extend(children.pop(id_, []))
+
+    # whatever is left in children either has unknown parent or forms a cycle
+    orphaned = categories.keys() - set(ordered)
+    removed = existing - categories.keys()
+    if orphaned:
+        logger.warning(f'{supplier} feed has categories with unknown parents: {sorted(orphaned)}')
+    if removed:
+        logger.warning(f'{supplier} feed misses previously saved categories: {sorted(removed)}')
+
     SupplierCategory.objects.bulk_create(
-        categories, update_conflicts=True, update_fields=[
-            'name',
-            'parent_category_id'
-        ], unique_fields=['id']
+        [
+            SupplierCategory(id=id_, supplier=supplier, parent_category_id=categories[id_][0], name=categories[id_][1])
+            for id_ in ordered
+        ],
+        update_conflicts=True,
+        update_fields=['name', 'parent_category_id'],
+        unique_fields=['id'],
     )
+    transaction.on_commit(lambda: invalidate_category_tree(SupplierCategory))
+
+    stats.categories = len(ordered)
+    stats.orphaned_categories = len(orphaned)
+    stats.removed_categories = len(removed)
+    return existing | set(ordered)
+
+
+FEED_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+SEEN_OFFERS_TABLE = 'supplies_seen_offer'
 
-    categories = SupplierCategory.objects.filter(supplier=supplier).values_list('pk', flat=True)
-
-    # Iterate through offer elements
-    for offer_element in root.findall(".//offers/offer"):
-        offer_data = {
-            'id': offer_element.get('id'),
-            'group_id': offer_element.get('group_id'),
-            'available': offer_element.get('available') == "true",
-            'params': '',
-            'pictures': [],
-        }
-
-        # Extract data from XML
-        for field_element in offer_element:
-            field_name = field_element.tag
-            field_value = field_element.text
-            if field_name == 'param':
-                offer_data['params'] += ET.tostring(field_element, encoding='utf-8').decode('utf-8') + '\n'
-            elif field_name == 'picture':
-                offer_data['pictures'].append(field_value)
-            elif field_name == 'categoryId':
-                category_id = int(field_value)
-                if category_id in categories:
-                    offer_data['category_id'] = category_id
-            elif field_name in ['keywords', 'keywords_ua'] and field_value is not None:
-                offer_data[field_name] = [x.strip() for x in field_value.split(',')]
-            elif field_value is not None and field_name in [f.name for f in SupplierOffer._meta.fields]:
-                if field_name in ['pickup', 'delivery']:
-                    field_value = field_value.lower() == 'true'
-                offer_data[field_name] = field_value
-
-        # Create or update Offer and SupplierOffer models
-        SupplierOffer.objects.update_or_create(
-            id=offer_data.get('id'),
-            supplier=supplier,
-            defaults=offer_data
+# fields overwritten when an already known supplier offer comes with the feed again
+SUPPLIER_OFFER_UPDATE_FIELDS = [
+    f.name for f in SupplierOffer._meta.concrete_fields
+    if f.name not in ['_id', 'created_at', 'supplier', 'id']
+]
+
+
+def parse_offer(offer_element, handlers: Dict[str, Handler]) -> Dict:
+    """
+    :param handlers: dispatch table compiled by `compile_field_mapping`
+    """
+    if not offer_element.get('id'):
+        raise ValueError('offer has no id')
+
+    offer_data = {
+        'id': offer_element.get('id'),
+        'group_id': offer_element.get('group_id'),
+        'available': offer_element.get('available') == "true",
+        'params': '',
+        'param_values': [],
+        'pictures': [],
+    }
+
+    # Extract data from XML
+    for field_element in offer_element:
+        handler = handlers.get(field_element.tag)
+        if handler is not None:
+            handler(offer_data, field_element)
+
+    return offer_data
+
+
+def offer_digest(offer_data: Dict) -> str:
+    return hashlib.sha256(
+        json.dumps(offer_data, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+@contextmanager
+def seen_offers_table():
+    """
+    Creates temporary table collecting ids of offers seen in the ingested feed.
+    Temporary tables are private to the database session, so concurrent ingests don't interfere.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE {SEEN_OFFERS_TABLE} (id varchar(255) PRIMARY KEY)')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEEN_OFFERS_TABLE}')
+
+
+def mark_offers_seen(ids: List[str]):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {SEEN_OFFERS_TABLE} (id) VALUES {", ".join(["(%s)"] * len(ids))} ON CONFLICT DO NOTHING',
+            ids
         )
 
 
-def load_offers(supplier: Supplier):
+def reconcile_vanished_offers(supplier: Supplier, stats: OffersIngestStats):
+    """
+    Marks supplier offers missing in the ingested feed as unavailable with a single UPDATE.
+    Offers published from them are deactivated if settings.DEACTIVATE_VANISHED_OFFERS is on.
+    Only offers vanished since the previous ingest are counted, ones already unavailable are not touched.
+    """
+    vanished = SupplierOffer.objects.filter(supplier=supplier, available=True).exclude(
+        id__in=RawSQL(f'SELECT id FROM {SEEN_OFFERS_TABLE}', [])
+    )
+    if settings.DEACTIVATE_VANISHED_OFFERS:
+        Offer.objects.filter(supplier_offer__in=vanished, active=True).update(active=False)
+    # digest is reset, so the offer is saved again when it's back in the feed even if it didn't change
+    stats.vanished = vanished.update(available=False, digest=None, updated_at=timezone.now())
+
+
+def upsert_offers(offers_data: List[Dict], supplier: Supplier, stats: OffersIngestStats):
+    """
+    Creates or updates a batch of supplier offers with a single INSERT ... ON CONFLICT statement.
+    Offers with the same digest as the stored ones are skipped.
+    """
+    # the same offer can't be affected twice by one statement, so the last occurrence wins like it would with
+    # sequential updates
+    offers_data = {data['id']: data for data in offers_data}
+    mark_offers_seen(list(offers_data.keys()))
+    digests = dict(
+        SupplierOffer.objects.filter(supplier=supplier, id__in=offers_data.keys()).values_list('id', 'digest')
+    )
+
+    offers = []
+    for id_, data in offers_data.items():
+        digest = offer_digest(data)
+        if id_ not in digests:
+            stats.new += 1
+        elif digests[id_] != digest:
+            stats.changed += 1
+        else:
+            stats.unchanged += 1
+            continue
+        offers.append(SupplierOffer(supplier=supplier, digest=digest, **data))
+
+    SupplierOffer.objects.bulk_create(
+        offers,
+        update_conflicts=True,
+        update_fields=SUPPLIER_OFFER_UPDATE_FIELDS,
+        unique_fields=['supplier', 'id'],
+    )
+
+
+@contextmanager
+def measure(stats: OffersIngestStats, stage: str):
+    """
+    Adds time spent in the context to the `stage` timing of the stats
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.timings[stage] = stats.timings.get(stage, 0) + time.perf_counter() - started_at
+
+
+def save_offers(xml_data, supplier, batch_size: int = None) -> OffersIngestStats:
+    """
+    Saves supplier categories and offers from YML feed.
+    The feed is parsed incrementally, so it can be passed as a file or a stream (e.g. raw HTTP response).
+    Offers are written in batches of `batch_size` (settings.SUPPLIER_OFFERS_BATCH_SIZE by default).
+    Supplier offers missing in the feed are marked unavailable afterwards.
+    :param xml_data: feed content (bytes), file name or file-like object
+    :return: counts of new, changed, unchanged and vanished offers, errors and timings of ingest stages
+    """
+    if isinstance(xml_data, bytes):
+        xml_data = BytesIO(xml_data)
+    batch_size = batch_size or settings.SUPPLIER_OFFERS_BATCH_SIZE
+
+    stats = OffersIngestStats()
+    started_at = timezone.now()
+    categories = {}
+    handlers = None
+    batch = []
+
+    with measure(stats, 'ingest'), seen_offers_table():
+        for element in iter_feed_elements(xml_data):
+            if element.tag == 'category':
+                parent_id = element.get('parentId')
+                categories[int(element.get('id'))] = (int(parent_id) if parent_id else None, element.text)
+                continue
+
+            # YML feeds list categories before offers, so they can be saved before the first offer is handled
+            if handlers is None:
+                with measure(stats, 'categories'):
+                    handlers = compile_field_mapping(
+                        get_field_mapping(supplier),
+                        sync_categories(categories, supplier, stats)
+                    )
+
+            try:
+                batch.append(parse_offer(element, handlers))
+            except (ValueError, ArithmeticError) as ex:
+                # stored version of the offer is kept untouched
+                logger.warning(f'{supplier} offer {element.get("id")} is skipped: {ex!r}')
+                stats.errors += 1
+                if element.get('id'):
+                    mark_offers_seen([element.get('id')])
+
+            if len(batch) >= batch_size:
+                with measure(stats, 'upsert'):
+                    upsert_offers(batch, supplier, stats)
+                batch = []
+
+        if handlers is None:
+            # feed without offers is most likely broken, so the offers are not reconciled
+            logger.warning(f'{supplier} feed has no offers')
+            with measure(stats, 'categories'):
+                sync_categories(categories, supplier, stats)
+            return stats
+
+        with measure(stats, 'upsert'):
+            if batch:
+                upsert_offers(batch, supplier, stats)
+            update_final_prices(Offer.objects.filter(
+                supplier_offer__supplier=supplier, supplier_offer__updated_at__gte=started_at
+            ))
+
+        with measure(stats, 'reconcile'):
+            reconcile_vanished_offers(supplier, stats)
+
+    # parsing is interleaved with writes, so its time is whatever is left from the other stages
+    stats.timings['parse'] = stats.timings['ingest'] - sum(
+        stats.timings.get(stage, 0) for stage in ['categories', 'upsert', 'reconcile']
+    )
+    return stats
+
+
+@contextmanager
+def supplier_feed_lock(supplier: Supplier, timeout: int = None):
+    """
+    Marks supplier feed as being ingested until the context is exited or `timeout` seconds passed
+    (settings.CELERY_TASK_TIME_LIMIT by default, so a lock of a killed worker expires with its task).
+    :raises FeedLocked: if the feed is already being ingested
+    """
+    now = timezone.now()
+    acquired = Supplier.objects.filter(
+        Q(feed_locked_until__isnull=True) | Q(feed_locked_until__lt=now),
+        pk=supplier.pk,
+    ).update(feed_locked_until=now + timedelta(seconds=timeout or settings.CELERY_TASK_TIME_LIMIT))
+    if not acquired:
+        raise FeedLocked(f'{supplier} feed is already being ingested')
+
+    try:
+        yield
+    finally:
+        Supplier.objects.filter(pk=supplier.pk).update(feed_locked_until=None)
+
+
+@contextmanager
+def download_feed(supplier: Supplier):
+    """
+    Downloads supplier feed into a temporary file.
+    The request is conditional on validators of the previously ingested feed, nothing is downloaded if the feed
+    wasn't modified since then. Validators of the downloaded feed are set to the supplier (but not saved).
+    :return: context manager with the feed file or None if the feed is not modified
+    """
     headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
-    # Download XML content from the URL
-    response = requests.get(supplier.feed_url, headers=headers)
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36',
+        'Accept-Encoding': 'gzip, deflate',
+    }
+    if supplier.feed_etag:
+        headers['If-None-Match'] = supplier.feed_etag
+    if supplier.feed_last_modified:
+        headers['If-Modified-Since'] = supplier.feed_last_modified
 
-    # Check if the request was successful (status code 200)
-    if response.status_code != 200:
-        response.raise_for_status()
+    with requests.get(supplier.feed_url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            yield None
+            return
+
+        # Check if the request was successful (status code 200)
+        if response.status_code != 200:
+            response.raise_for_status()
 
-    return save_offers(response.content, supplier=supplier)
+        with tempfile.TemporaryFile() as feed_file:
+            # iter_content decodes gzip/deflate content encoding on the fly
+            for chunk in response.iter_content(chunk_size=FEED_DOWNLOAD_CHUNK_SIZE):
+                feed_file.write(chunk)
+            feed_file.seek(0)
+
+            supplier.feed_etag = response.headers.get('ETag', '')
+            supplier.feed_last_modified = response.headers.get('Last-Modified', '')
+            yield feed_file
+
+
+def load_offers(supplier: Supplier) -> Optional[OffersIngestStats]:
+    """
+    :return: ingest stats or None if the feed wasn't modified since the last load
+    """
+    started_at = time.perf_counter()
+    with download_feed(supplier) as feed_file:
+        if feed_file is None:
+            logger.info(f'{supplier} feed is not modified, skipping')
+            return None
+
+        download_time = time.perf_counter() - started_at
+        snapshot = ''
+        if settings.FEED_SNAPSHOTS_KEEP:
+            snapshot = archive_feed(feed_file, supplier)
+            feed_file.seek(0)
+
+        stats = save_offers(feed_file, supplier=supplier)
+        stats.timings['download'] = download_time
+        stats.bytes_fetched = os.fstat(feed_file.fileno()).st_size
+        stats.snapshot = snapshot
+
+    # validators are saved only after successful ingest, so failed feed is downloaded again next time
+    supplier.save(update_fields=['feed_etag', 'feed_last_modified'])
+    return stats
 
 
 def generate_merchant_center_xml():
@@ -272,46 +874,161 @@ def generate_merchant_center_xml():
         f.write(ET.tostring(root, encoding='unicode'))
 
 
-# async def fetch(url):
-#     response = await loop.run_in_executor(None, requests.get, url)
-#     return response
+GMC_NAMESPACES = {'g': 'http://base.google.com/ns/1.0'}
+# image with fewer detected text regions is considered to have no text
+MIN_TEXT_REGIONS = 10
+IMAGE_VERDICTS_BATCH_SIZE = 1000
 
-async def agenerate_merchant_center_xml():
+
+class HostLimiter:
     """
-    This is a temporary solution for generation GMC feed.
-    It delegates generation to external service and replaces main image
-    :return: content of xml file
+    Limits number of concurrent requests in total and to every host
     """
 
-    response = await asyncio.to_thread(requests.get, settings.MERCHANT_CENTER_FEED_URL)
+    def __init__(self, total: int, per_host: int):
+        self.total = asyncio.Semaphore(total)
+        self.hosts = defaultdict(lambda: asyncio.Semaphore(per_host))
 
-    if response.status_code != 200:
-        response.raise_for_status()
+    @asynccontextmanager
+    async def limit(self, url: str):
+        async with self.hosts[urlsplit(url).hostname], self.total:
+            yield
 
-    ET.register_namespace('g', 'http://base.google.com/ns/1.0')
-    root = ET.fromstring(response.content)
-    ns = {'g': 'http://base.google.com/ns/1.0'}
 
-    items = root.findall('.//item')
+class ImageVerdicts:
+    """
+    Text detection verdicts of the GMC feed images, changed verdicts are saved in batches
+    """
 
-    request_count = 0
+    def __init__(self, verdicts: List[ImageTextVerdict]):
+        self.verdicts = {v.url: v for v in verdicts}
+        self.pending: Dict[str, ImageTextVerdict] = {}
+        self.stats = defaultdict(int)
+
+    @classmethod
+    async def load(cls, urls: List[str]) -> 'ImageVerdicts':
+        verdicts = []
+        for chunk in iter_chunks(urls, IMAGE_VERDICTS_BATCH_SIZE):
+            verdicts += [v async for v in ImageTextVerdict.objects.filter(url__in=chunk)]
+        return cls(verdicts)
+
+    def get(self, url: str) -> Optional[ImageTextVerdict]:
+        return self.verdicts.get(url)
+
+    async def put(self, verdict: ImageTextVerdict):
+        self.verdicts[verdict.url] = self.pending[verdict.url] = verdict
+        if len(self.pending) >= IMAGE_VERDICTS_BATCH_SIZE:
+            await self.save()
+
+    async def save(self):
+        pending, self.pending = list(self.pending.values()), {}
+        await ImageTextVerdict.objects.abulk_create(
+            pending,
+            batch_size=IMAGE_VERDICTS_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['url'],
+            update_fields=['etag', 'last_modified', 'content_hash', 'has_text', 'regions', 'checked_at'],
+        )
 
-    for item in items:
-        # Find the image_link and additional_image_link elements
-        image_link = item.find('.//g:image_link', ns)
-        additional_image_links = item.findall('.//g:additional_image_link', ns)
 
-        for l in additional_image_links:
-            resp = await asyncio.to_thread(requests.get, l.text)
-            image_data = np.frombuffer(resp.content, dtype=np.uint8)
-            image = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
-            if len(swt_text_detection(image)) < 10:
-                image_link.text = l.text
-                break
+async def image_has_text(
+    client: httpx.AsyncClient, limiter: HostLimiter, verdicts: ImageVerdicts, url: str
+) -> Optional[bool]:
+    """
+    Detects text on the image unless it is the same as when it was checked last time:
+    the image is requested with its ETag and Last-Modified, and its content hash is compared if it is sent anyway
+    :return: whether text is detected on the image, None if the image is not available
+    """
+    verdict = verdicts.get(url)
+    headers = {}
+    if verdict and verdict.etag:
+        headers['If-None-Match'] = verdict.etag
+    if verdict and verdict.last_modified:
+        headers['If-Modified-Since'] = verdict.last_modified
+    try:
+        async with limiter.limit(url):
+            response = await client.get(url, headers=headers)
+        if response.status_code == 304 and verdict:
+            verdicts.stats['not_modified'] += 1
+            return verdict.has_text
+        response.raise_for_status()
+    except httpx.HTTPError as ex:
+        logger.warning(f'Image {url} is not downloaded: {ex!r}')
+        return None
+
+    etag, last_modified = response.headers.get('ETag', ''), response.headers.get('Last-Modified', '')
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if verdict and verdict.content_hash == content_hash:
+        verdicts.stats['unchanged'] += 1
+        if (verdict.etag, verdict.last_modified) != (etag, last_modified):
+            verdict.etag, verdict.last_modified = etag, last_modified
+            await verdicts.put(verdict)
+        return verdict.has_text
+
+    image = cv2.imdecode(np.frombuffer(response.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        logger.warning(f'Image {url} is not decoded')
+        return None
+    # detection is CPU bound, so it doesn't block downloads of other images
+    regions = len(await asyncio.to_thread(swt_text_detection, image))
+    verdicts.stats['detected'] += 1
+
+    verdict = verdict or ImageTextVerdict(url=url)
+    verdict.etag, verdict.last_modified, verdict.content_hash = etag, last_modified, content_hash
+    verdict.regions, verdict.has_text = regions, regions >= MIN_TEXT_REGIONS
+    verdict.checked_at = timezone.now()
+    await verdicts.put(verdict)
+    return verdict.has_text
+
+
+async def replace_image_link(client: httpx.AsyncClient, limiter: HostLimiter, verdicts: ImageVerdicts, item):
+    """
+    Replaces main image of the GMC item with the first additional image without text
+    """
+    image_link = item.find('.//g:image_link', GMC_NAMESPACES)
+    for link in item.findall('.//g:additional_image_link', GMC_NAMESPACES):
+        if await image_has_text(client, limiter, verdicts, link.text) is False:
+            image_link.text = link.text
+            break
+
 
-        request_count += 1
-        if request_count % 100 == 0:
-            await asyncio.sleep(2)  # Pause for 5 seconds after every 100 requests
+async def agenerate_merchant_center_xml():
+    """
+    This is a temporary solution for generation GMC feed.
+    It delegates generation to external service and replaces main image.
+    Items are processed concurrently, images are downloaded through one connection pool with
+    settings.MERCHANT_CENTER_IMAGE_CONCURRENCY concurrent requests at most,
+    settings.MERCHANT_CENTER_IMAGE_PER_HOST_CONCURRENCY of them to the same host.
+    Text detection verdicts are stored in ImageTextVerdict, so only new and changed images are checked.
+    """
+    limiter = HostLimiter(
+        settings.MERCHANT_CENTER_IMAGE_CONCURRENCY, settings.MERCHANT_CENTER_IMAGE_PER_HOST_CONCURRENCY
+    )
+    async with httpx.AsyncClient(
+        timeout=settings.MERCHANT_CENTER_IMAGE_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=settings.MERCHANT_CENTER_IMAGE_CONCURRENCY,
+            max_keepalive_connections=settings.MERCHANT_CENTER_IMAGE_CONCURRENCY,
+        ),
+        follow_redirects=True,
+    ) as client:
+        response = await client.get(settings.MERCHANT_CENTER_FEED_URL, timeout=None)
+        response.raise_for_status()
+
+        ET.register_namespace('g', GMC_NAMESPACES['g'])
+        root = ET.fromstring(response.content)
+        items = root.findall('.//item')
+        verdicts = await ImageVerdicts.load(list({
+            link.text for link in root.iterfind('.//g:additional_image_link', GMC_NAMESPACES)
+        }))
+        started_at = time.perf_counter()
+        await asyncio.gather(*(replace_image_link(client, limiter, verdicts, item) for item in items))
+        await verdicts.save()
+        logger.info(
+            f'Images of {len(items)} GMC items checked in {time.perf_counter() - started_at:.1f}s: '
+            f'{verdicts.stats["detected"]} detected, {verdicts.stats["not_modified"]} not modified, '
+            f'{verdicts.stats["unchanged"]} unchanged'
+        )
 
     path = os.path.join(settings.MEDIA_ROOT, 'supplies/gmc_feed.xml')
     with open(path, 'w', encoding='utf-8') as f:
@@ -0,0 +1,116 @@
+"""
+Mapping of supplier feed tags to SupplierOffer fields.
+
+Every supplier uses the default mapping (tags named after SupplierOffer fields) extended with its own
+`Supplier.field_mapping`, e.g. {"price_old": "oldprice", "stockQuantity": "quantity_in_stock"}.
+A tag mapped to null is ignored. Before ingest the mapping is compiled into a dispatch table of tag handlers,
+so an offer is parsed with one dict lookup and one call per element.
+"""
+from decimal import Decimal
+from typing import Callable, Dict, Iterable
+
+from django.db import models
+from lxml import etree as ET
+
+from supplies.models import Supplier, SupplierOffer
+
+Handler = Callable[[Dict, ET._Element], None]
+
+# fields that are not filled from offer child elements
+NOT_MAPPED_FIELDS = [
+    '_id', 'created_at', 'updated_at', 'supplier', 'id', 'available', 'group_id', 'digest', 'param_values'
+]
+
+DEFAULT_FIELD_MAPPING = {
+    **{
+        f.name: f.name for f in SupplierOffer._meta.concrete_fields
+        if f.name not in NOT_MAPPED_FIELDS + ['category', 'params', 'pictures']
+    },
+    'categoryId': 'category',
+    'param': 'params',
+    'picture': 'pictures',
+}
+
+
+def to_bool(value: str) -> bool:
+    return value.lower() == 'true'
+
+
+def to_decimal(value: str) -> Decimal:
+    return Decimal(value.strip().replace(',', '.'))
+
+
+def to_list(value: str) -> list:
+    return [x.strip() for x in value.split(',')]
+
+
+COERCERS = {
+    models.BooleanField: to_bool,
+    models.DecimalField: to_decimal,
+    models.IntegerField: int,
+    models.PositiveIntegerField: int,
+    models.BigIntegerField: int,
+    models.JSONField: to_list,
+}
+
+
+def get_field_mapping(supplier: Supplier) -> Dict[str, str]:
+    return {**DEFAULT_FIELD_MAPPING, **(supplier.field_mapping or {})}
+
+
+def field_handler(field_name: str) -> Handler:
+    coerce = COERCERS.get(type(SupplierOffer._meta.get_field(field_name)), str)
+
+    def handle(offer_data, element):
+        if element.text is not None:
+            offer_data[field_name] = coerce(element.text)
+
+    return handle
+
+
+def category_handler(categories: Iterable[int]) -> Handler:
+    def handle(offer_data, element):
+        category_id = int(element.text)
+        if category_id in categories:
+            offer_data['category_id'] = category_id
+
+    return handle
+
+
+def parse_param(element: ET._Element) -> Dict:
+    param = {'name': element.get('name')}
+    if element.get('unit') is not None:
+        param['unit'] = element.get('unit')
+    param['value'] = element.text
+    return param
+
+
+def params_handler(offer_data, element):
+    # the text keeps the original elements for people and prompts, the structure is used by the export
+    offer_data['params'] += ET.tostring(element, encoding='utf-8').decode('utf-8') + '\n'
+    offer_data['param_values'].append(parse_param(element))
+
+
+def pictures_handler(offer_data, element):
+    offer_data['pictures'].append(element.text)
+
+
+def compile_field_mapping(mapping: Dict[str, str], categories: Iterable[int]) -> Dict[str, Handler]:
+    """
+    :param mapping: feed tag -> SupplierOffer field name
+    :param categories: ids of known supplier categories, offers can't reference other categories
+    :return: feed tag -> handler setting parsed element value to offer data
+    """
+    special_handlers = {
+        'category': category_handler(categories),
+        'params': params_handler,
+        'pictures': pictures_handler,
+    }
+    handlers = {}
+    for tag, field_name in mapping.items():
+        if field_name is None:
+            continue
+        if field_name in NOT_MAPPED_FIELDS:
+            raise ValueError(f'Feed tag {tag} can not be mapped to {field_name} field')
+        handlers[tag] = special_handlers.get(field_name) or field_handler(field_name)
+    return handlers
@@ -0,0 +1,206 @@
+"""
+Vectorized pricing engine.
+
+Prices of the whole catalog are computed in one pass with pandas instead of one offer at a time.
+Money is kept in integer cents and multipliers in hundredths (both model fields have 2 decimal places),
+so the results are exactly the same as the Decimal arithmetic of the feed export (see `offer_row_to_data`).
+
+Multipliers come from PriceRule tables: `preview_repricing` shows what the rules would change,
+`apply_repricing` writes the new multipliers with one UPDATE per distinct multiplier.
+"""
+import logging
+from decimal import Decimal
+from typing import List
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import QuerySet, F, OuterRef, Subquery, Value, DecimalField
+from django.db.models.functions import Ceil, Coalesce, NullIf
+from django.utils import timezone
+
+from supplies.models import Offer, PriceRule, SupplierOffer
+from supplies.services.categories import get_category_tree
+
+logger = logging.getLogger(__name__)
+
+# frame column -> Offer lookup
+PRICING_COLUMNS = {
+    'pk': 'pk',
+    'supplier_id': 'supplier_offer__supplier_id',
+    'site_category_id': 'supplier_offer__category__site_category_id',
+    'suggested_price': 'suggested_price',
+    'price_multiplier': 'price_multiplier',
+    'supplier_price': 'supplier_offer__price',
+    'oldprice': 'supplier_offer__oldprice',
+    'price_old': 'supplier_offer__price_old',
+    'discount': 'supplier_offer__discount',
+}
+DECIMAL_COLUMNS = ['suggested_price', 'price_multiplier', 'supplier_price', 'oldprice', 'price_old', 'discount']
+OLD_PRICE_COLUMNS = ['oldprice', 'price_old']
+# old price below our price is replaced with the price 30% higher than the supplier old price
+OLD_PRICE_FALLBACK_PERCENT = 130
+REPRICE_UPDATE_BATCH_SIZE = 10000
+
+
+def final_price_expression():
+    """
+    SQL version of `Offer.price` rounded up like the export does: ceil((suggested or supplier price) * multiplier)
+    """
+    supplier_price = Subquery(SupplierOffer.objects.filter(pk=OuterRef('supplier_offer_id')).values('price')[:1])
+    return Ceil(
+        Coalesce(NullIf(F('suggested_price'), Value(Decimal(0))), supplier_price)
+        * Coalesce(NullIf(F('price_multiplier'), Value(Decimal(0))), Value(Decimal(1))),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def update_final_prices(offer_queryset: QuerySet[Offer] = None) -> int:
+    """
+    Recalculates Offer.final_price with one UPDATE, must follow every change of offer prices or multipliers
+    made bypassing Offer.save and SupplierOffer.save
+    :return: number of updated offers
+    """
+    offer_queryset = Offer.objects.all() if offer_queryset is None else offer_queryset
+    return offer_queryset.update(final_price=final_price_expression())
+
+
+def to_hundredths(values: pd.Series) -> pd.Series:
+    """
+    Converts decimals with 2 decimal places to integer cents (hundredths), None becomes <NA>
+    """
+    return np.rint(pd.to_numeric(values, errors='coerce').astype('float64') * 100).astype('Int64')
+
+
+def ceil_div(numerator: pd.Series, denominator: int) -> pd.Series:
+    return -(-numerator // denominator)
+
+
+def load_offer_prices(offer_queryset: QuerySet[Offer] = None) -> pd.DataFrame:
+    """
+    Fetches everything needed for pricing with one query
+    :return: frame indexed by offer pk, money in cents and multipliers in hundredths
+    """
+    offer_queryset = Offer.objects.all() if offer_queryset is None else offer_queryset
+    frame = pd.DataFrame.from_records(
+        list(offer_queryset.values_list(*PRICING_COLUMNS.values())), columns=list(PRICING_COLUMNS)
+    )
+    for column in DECIMAL_COLUMNS:
+        frame[column] = to_hundredths(frame[column])
+    for column in ['supplier_id', 'site_category_id']:
+        frame[column] = frame[column].astype('Int64')
+
+    suggested = frame['suggested_price']
+    frame['base_price'] = suggested.where(suggested.notna() & (suggested != 0), frame['supplier_price'])
+    return frame.set_index('pk')
+
+
+def get_price_rules() -> List[PriceRule]:
+    """
+    :return: active rules, the least specific first
+    """
+    tree = get_category_tree()
+
+    def specificity(rule: PriceRule):
+        category_depth = len(tree.get_ancestors(rule.site_category_id)) + 1 if rule.site_category_id else 0
+        has_band = rule.min_price is not None or rule.max_price is not None
+        return rule.supplier_id is not None, category_depth, has_band, rule.pk
+
+    return sorted(PriceRule.objects.filter(active=True), key=specificity)
+
+
+def resolve_price_rules(frame: pd.DataFrame, rules: List[PriceRule]) -> pd.DataFrame:
+    """
+    :param rules: rules ordered by `get_price_rules`, later rules override earlier ones
+    :return: frame with `rule_id` and `multiplier` (hundredths) of the matching rule, <NA> for unmatched offers
+    """
+    tree = get_category_tree()
+    result = pd.DataFrame({
+        'rule_id': pd.array([pd.NA] * len(frame), dtype='Int64'),
+        'multiplier': pd.array([pd.NA] * len(frame), dtype='Int64'),
+    }, index=frame.index)
+
+    for rule in rules:
+        mask = pd.Series(True, index=frame.index)
+        if rule.supplier_id is not None:
+            mask &= frame['supplier_id'].eq(rule.supplier_id).fillna(False)
+        if rule.site_category_id is not None:
+            mask &= frame['site_category_id'].isin(tree.get_descendants(rule.site_category_id)).fillna(False)
+        if rule.min_price is not None:
+            mask &= frame['base_price'].ge(round(rule.min_price * 100)).fillna(False)
+        if rule.max_price is not None:
+            mask &= frame['base_price'].lt(round(rule.max_price * 100)).fillna(False)
+
+        mask = mask.astype(bool)
+        result.loc[mask, 'rule_id'] = rule.pk
+        result.loc[mask, 'multiplier'] = round(rule.multiplier * 100)
+    return result
+
+
+def compute_prices(frame: pd.DataFrame, multiplier: pd.Series) -> pd.DataFrame:
+    """
+    Computes exported prices the same way as the feed export does
+    :param frame: frame loaded by `load_offer_prices`
+    :param multiplier: price multipliers in hundredths, <NA> for offers without a multiplier
+    :return: frame with price, oldprice, price_old and discount in currency units, NaN where the value is not exported
+    """
+    # zero multiplier is ignored by the export, the same as a missing one
+    multiplier = multiplier.where(multiplier != 0)
+    has_multiplier = multiplier.notna()
+    # exact price in 1/10000 of the currency unit
+    exact_price = frame['base_price'] * multiplier.fillna(100)
+
+    prices = pd.DataFrame(index=frame.index)
+    prices['price'] = ceil_div(exact_price, 10000).astype('Float64')
+    for column in OLD_PRICE_COLUMNS + ['discount']:
+        value = frame[column]
+        multiplied = ceil_div(value * multiplier, 10000)
+        if column in OLD_PRICE_COLUMNS:
+            fallback = ceil_div(value * OLD_PRICE_FALLBACK_PERCENT, 10000)
+            multiplied = multiplied.mask(value * 100 < exact_price, fallback)
+        # without a multiplier supplier values are exported as is
+        prices[column] = multiplied.astype('Float64').where(has_multiplier, value.astype('Float64') / 100)
+    return prices.astype('float64')
+
+
+def preview_repricing(offer_queryset: QuerySet[Offer] = None) -> pd.DataFrame:
+    """
+    Computes prices of offers matched by price rules without changing anything
+    :return: frame indexed by offer pk with current and new multipliers and prices, only offers matched by rules
+    """
+    frame = load_offer_prices(offer_queryset)
+    resolved = resolve_price_rules(frame, get_price_rules())
+    matched = resolved['rule_id'].notna()
+    frame, resolved = frame[matched], resolved[matched]
+
+    current = compute_prices(frame, frame['price_multiplier'])
+    new = compute_prices(frame, resolved['multiplier'])
+    preview = pd.concat([
+        frame[['supplier_id', 'site_category_id']],
+        resolved['rule_id'],
+        (frame['price_multiplier'] / 100).rename('current_multiplier'),
+        (resolved['multiplier'] / 100).rename('new_multiplier'),
+        current['price'].rename('current_price'),
+        new.add_prefix('new_'),
+    ], axis=1)
+    preview['changed'] = frame['price_multiplier'].ne(resolved['multiplier']).fillna(True).astype(bool)
+    return preview
+
+
+@transaction.atomic
+def apply_repricing(preview: pd.DataFrame) -> int:
+    """
+    Writes new multipliers of the changed offers from `preview_repricing` result
+    :return: number of updated offers
+    """
+    changed = preview[preview['changed']]
+    now = timezone.now()
+    for multiplier, group in changed.groupby('new_multiplier'):
+        ids = group.index.tolist()
+        for start in range(0, len(ids), REPRICE_UPDATE_BATCH_SIZE):
+            offers = Offer.objects.filter(pk__in=ids[start:start + REPRICE_UPDATE_BATCH_SIZE])
+            # updated_at is bumped, so cached feed fragments of these offers are re-rendered
+            offers.update(price_multiplier=Decimal(round(multiplier * 100)) / 100, updated_at=now)
+            update_final_prices(offers)
+    logger.info(f'Price rules applied to {len(changed)} offers')
+    return len(changed)
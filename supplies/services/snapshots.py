@@ -0,0 +1,91 @@
+"""
+Archive of downloaded supplier feeds.
+
+Every downloaded feed is stored gzip-compressed under MEDIA_ROOT/supplies/feeds/<supplier id>/ and named by sha256
+of its content, so unchanged feeds are stored once. Only settings.FEED_SNAPSHOTS_KEEP most recent snapshots
+are kept per supplier. Snapshots can be ingested again with `replay_feed` command.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+from django.conf import settings
+
+from supplies.models import Supplier
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = '.xml.gz'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_snapshots_dir(supplier: Supplier) -> Path:
+    return Path(settings.MEDIA_ROOT) / 'supplies' / 'feeds' / str(supplier.pk)
+
+
+def list_snapshots(supplier: Supplier) -> List[Path]:
+    """
+    :return: snapshots of the supplier feed, the most recent first
+    """
+    snapshots_dir = get_snapshots_dir(supplier)
+    if not snapshots_dir.exists():
+        return []
+    return sorted(snapshots_dir.glob(f'*{SNAPSHOT_SUFFIX}'), key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def find_snapshot(supplier: Supplier, digest: str = None) -> Optional[Path]:
+    """
+    :param digest: digest of the snapshot or its prefix, the most recent snapshot is returned if not provided
+    """
+    for path in list_snapshots(supplier):
+        if not digest or path.name.startswith(digest):
+            return path
+    return None
+
+
+def archive_feed(feed_file, supplier: Supplier) -> str:
+    """
+    Stores compressed copy of the feed file. The file is read from its current position to the end.
+    :return: sha256 digest of the feed content
+    """
+    snapshots_dir = get_snapshots_dir(supplier)
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+
+    sha256 = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=snapshots_dir, suffix='.tmp', delete=False) as tmp_file:
+        try:
+            with gzip.GzipFile(fileobj=tmp_file, mode='wb') as gz_file:
+                while chunk := feed_file.read(COPY_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    gz_file.write(chunk)
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+
+    digest = sha256.hexdigest()
+    path = snapshots_dir / f'{digest}{SNAPSHOT_SUFFIX}'
+    if path.exists():
+        # the same feed is already archived, just mark it as the most recent one
+        os.unlink(tmp_file.name)
+        path.touch()
+    else:
+        os.replace(tmp_file.name, path)
+
+    prune_snapshots(supplier)
+    return digest
+
+
+def prune_snapshots(supplier: Supplier, keep: int = None):
+    keep = settings.FEED_SNAPSHOTS_KEEP if keep is None else keep
+    for path in list_snapshots(supplier)[keep:]:
+        logger.debug(f'Removing {supplier} feed snapshot {path.name}')
+        path.unlink(missing_ok=True)
+
+
+def open_snapshot(path: Path):
+    return gzip.open(path, 'rb')
+
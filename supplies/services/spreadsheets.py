@@ -0,0 +1,90 @@
+"""
+CSV and XLSX exports of offers for marketplace bulk imports.
+
+Rows are built from the same projection as the YML feed (`iter_offers_data`), one column per exported field.
+Offers are fetched in chunks and written row by row, so memory usage doesn't depend on the catalog size:
+CSV is streamed to the client, XLSX is written by openpyxl in write-only mode to a temporary file.
+"""
+import csv
+import tempfile
+from typing import Dict, Iterator, List
+
+from django.conf import settings
+from django.db.models import QuerySet
+from lxml import etree as ET
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from supplies.models import Offer
+from supplies.services.feed import SUPPLIER_OFFER_EXPORT_FIELDS, iter_offers_data
+
+SPREADSHEET_COLUMNS = ['id', 'available', 'group_id', 'categoryId'] + [
+    f for f in SUPPLIER_OFFER_EXPORT_FIELDS if f not in ['available', 'group_id']
+]
+# a lot of spreadsheet applications detect UTF-8 CSV by the byte order mark only
+CSV_BOM = '\ufeff'
+
+
+def format_params(params) -> str:
+    """
+    :param params: parsed params or raw XML of manually edited ones
+    :return: params as "Name: value unit; Name: value"
+    """
+    if isinstance(params, str):
+        try:
+            elements = ET.fromstring(f'<root>{params}</root>')
+        except ET.XMLSyntaxError:
+            return params
+        params = [
+            {'name': el.get('name'), 'unit': el.get('unit'), 'value': el.text} for el in elements.iter('param')
+        ]
+    return '; '.join(
+        f'{p["name"]}: {p["value"] or ""}' + (f' {p["unit"]}' if p.get('unit') else '') for p in params
+    )
+
+
+def offer_data_to_row(offer_data: Dict) -> List:
+    values = {**offer_data, **offer_data['_attrs']}
+    if 'pictures' in values:
+        values['pictures'] = ', '.join(str(url) for url in values['pictures'])
+    if 'params' in values:
+        values['params'] = format_params(values['params'])
+    return [values.get(column, '') for column in SPREADSHEET_COLUMNS]
+
+
+def iter_offer_rows_data(offer_queryset: QuerySet[Offer]) -> Iterator[List]:
+    for offer_data in iter_offers_data(offer_queryset, settings.FEED_EXPORT_CHUNK_SIZE):
+        yield offer_data_to_row(offer_data)
+
+
+class Echo:
+    """
+    File-like object returning what is written, so csv.writer can be used for streaming
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_offers_csv(offer_queryset: QuerySet[Offer]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield CSV_BOM + writer.writerow(SPREADSHEET_COLUMNS)
+    for row in iter_offer_rows_data(offer_queryset):
+        yield writer.writerow(row)
+
+
+def write_offers_xlsx(offer_queryset: QuerySet[Offer]):
+    """
+    :return: temporary file with the workbook, positioned at the beginning, removed once it's closed
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Offers')
+    sheet.append(SPREADSHEET_COLUMNS)
+    for row in iter_offer_rows_data(offer_queryset):
+        # control characters sometimes found in supplier descriptions are not allowed in XLSX
+        sheet.append([ILLEGAL_CHARACTERS_RE.sub('', v) if isinstance(v, str) else v for v in row])
+
+    xlsx_file = tempfile.TemporaryFile()
+    workbook.save(xlsx_file)
+    xlsx_file.seek(0)
+    return xlsx_file
@@ -0,0 +1,101 @@
+"""
+Generator of synthetic supplier YML feeds, used for benchmarking ingest and export.
+"""
+import random
+
+from lxml import etree as ET
+
+WORDS = [
+    'lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 'eiusmod',
+    'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua', 'enim', 'minim', 'veniam',
+]
+
+
+def words(rnd: random.Random, count: int) -> str:
+    return ' '.join(rnd.choice(WORDS) for _ in range(count))
+
+
+def generate_categories(depth: int, branching: int):
+    """
+    :return: list of (id, parent id) of a complete category tree, parents go first
+    """
+    categories = []
+    level = [None]
+    next_id = 1
+    for _ in range(depth):
+        next_level = []
+        for parent_id in level:
+            for _ in range(branching):
+                categories.append((next_id, parent_id))
+                next_level.append(next_id)
+                next_id += 1
+        level = next_level
+    return categories
+
+
+def write_yml_catalog(target, offers: int = 1000, params: int = 5, pictures: int = 3, category_depth: int = 3,
+                      category_branching: int = 4, seed: int = 0):
+    """
+    Writes synthetic YML catalog to `target` without building it in memory
+    :param target: file name or binary file-like object
+    :param offers: number of offers
+    :param params: number of <param> elements per offer
+    :param pictures: number of <picture> elements per offer
+    :param category_depth: depth of the category tree, offers reference leaf categories only
+    :param category_branching: number of children of every non-leaf category
+    :param seed: random seed, the same arguments always produce the same catalog
+    """
+    rnd = random.Random(seed)
+    categories = generate_categories(category_depth, category_branching)
+    parents = {parent_id for _, parent_id in categories}
+    leaves = [id_ for id_, _ in categories if id_ not in parents] or [None]
+
+    with ET.xmlfile(target, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('yml_catalog', date='2024-01-01 00:00'):
+            with xf.element('shop'):
+                for tag in ['name', 'company', 'url']:
+                    el = ET.Element(tag)
+                    el.text = 'synthetic'
+                    xf.write(el)
+
+                with xf.element('categories'):
+                    for id_, parent_id in categories:
+                        attrs = {'id': str(id_)}
+                        if parent_id:
+                            attrs['parentId'] = str(parent_id)
+                        el = ET.Element('category', attrib=attrs)
+                        el.text = f'Category {id_}'
+                        xf.write(el)
+
+                with xf.element('offers'):
+                    for i in range(offers):
+                        xf.write(generate_offer(rnd, i, rnd.choice(leaves), params, pictures))
+
+
+def generate_offer(rnd: random.Random, index: int, category_id, params: int, pictures: int):
+    price = rnd.randint(100, 10000)
+    offer = ET.Element('offer', id=f'SYN{index}', available=rnd.choice(['true', 'true', 'false']))
+    fields = [
+        ('url', f'https://example.com/products/{index}'),
+        ('price', str(price)),
+        ('oldprice', str(price * 13 // 10)),
+        ('currencyId', 'UAH'),
+        ('categoryId', str(category_id) if category_id else None),
+        ('name', words(rnd, 6)),
+        ('name_ua', words(rnd, 6)),
+        ('vendor', words(rnd, 1)),
+        ('vendorCode', f'V{index}'),
+        ('description', words(rnd, 80)),
+        ('description_ua', words(rnd, 80)),
+        ('quantity_in_stock', str(rnd.randint(0, 100))),
+        ('keywords', ', '.join(words(rnd, 2) for _ in range(5))),
+    ]
+    for tag, value in fields:
+        if value is not None:
+            ET.SubElement(offer, tag).text = value
+    for i in range(pictures):
+        ET.SubElement(offer, 'picture').text = f'https://example.com/images/{index}_{i}.jpg'
+    for i in range(params):
+        ET.SubElement(offer, 'param', name=f'Param {i}').text = words(rnd, 2)
+    return offer
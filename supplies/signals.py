@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from supplies.models import Offer, SupplierOffer, SiteCategory, SupplierCategory
+from supplies.services.artifacts import schedule_feed_rebuild, get_offer_shard_names
+from supplies.services.categories import invalidate_category_tree
+from supplies.services.feed import evict_offer_fragments
+from supplies.services.pricing import update_final_prices
+
+
+@receiver([post_save, post_delete], sender=SiteCategory)
+@receiver([post_save, post_delete], sender=SupplierCategory)
+def rebuild_feed_on_change(**_):
+    transaction.on_commit(schedule_feed_rebuild)
+
+
+@receiver(pre_save, sender=Offer)
+def remember_offer_shards(instance: Offer, **_):
+    # the offer may leave its shards (e.g. moves to another supplier offer), they are rebuilt too
+    instance._previous_feed_shards = set()
+    if instance.pk:
+        instance._previous_feed_shards = get_offer_shard_names(Offer.objects.filter(pk=instance.pk))
+
+
+@receiver(pre_save, sender=SupplierOffer)
+def remember_supplier_offer_shards(instance: SupplierOffer, **_):
+    # the offer may leave its shards (moves to another supplier or category), they are rebuilt too
+    instance._previous_feed_shards = set()
+    if instance.pk:
+        instance._previous_feed_shards = get_offer_shard_names(Offer.objects.filter(supplier_offer_id=instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Offer)
+def rebuild_feed_on_offer_change(signal, instance: Offer, **_):
+    # shard of a deleted offer can't be queried anymore, so all shards are rebuilt
+    shards = None if signal is post_delete else (
+        get_offer_shard_names(Offer.objects.filter(pk=instance.pk)) | instance._previous_feed_shards
+    )
+    transaction.on_commit(lambda: schedule_feed_rebuild(shards))
+
+
+@receiver([post_save, post_delete], sender=SupplierOffer)
+def rebuild_feed_on_supplier_offer_change(signal, instance: SupplierOffer, **_):
+    shards = get_offer_shard_names(Offer.objects.filter(supplier_offer_id=instance.pk))
+    if signal is post_save:
+        shards |= instance._previous_feed_shards
+    transaction.on_commit(lambda: schedule_feed_rebuild(shards))
+
+
+@receiver([post_save, post_delete], sender=Offer)
+def evict_offer_fragment(instance: Offer, **_):
+    evict_offer_fragments([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=SupplierOffer)
+def evict_supplier_offer_fragment(instance: SupplierOffer, **_):
+    evict_offer_fragments(Offer.objects.filter(supplier_offer_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=SiteCategory)
+@receiver([post_save, post_delete], sender=SupplierCategory)
+def invalidate_category_tree_on_change(sender, **_):
+    transaction.on_commit(lambda: invalidate_category_tree(sender))
+
+
+@receiver(post_save, sender=Offer)
+def update_offer_final_price(instance: Offer, **_):
+    update_final_prices(Offer.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=SupplierOffer)
+def update_supplier_offer_final_price(instance: SupplierOffer, **_):
+    update_final_prices(Offer.objects.filter(supplier_offer_id=instance.pk))
@@ -1,13 +1,21 @@
 import asyncio
-from typing import List
+import resource
+import sys
+from dataclasses import asdict
+from typing import List, Dict
 
-from celery import shared_task, chord
+from celery import shared_task, chord, group
 from celery.utils.log import get_task_logger
+from django.utils import timezone
 from openai import APITimeoutError
 
+from supplies.dto import OffersIngestStats
 from supplies.factories import get_content_manager, get_translator
-from supplies.models import Offer, Supplier
-from supplies.services.feed import load_offers, agenerate_merchant_center_xml, update_lugi_suggested_prices
+from supplies.models import Offer, Supplier, IngestRun
+from supplies.services.artifacts import build_feed_file, schedule_feed_rebuild, build_feed_shard, get_shard_names, \
+    get_offer_shard_names, prune_shards
+from supplies.services.feed import load_offers, agenerate_merchant_center_xml, update_lugi_suggested_prices, \
+    supplier_feed_lock, FeedLocked
 
 logger = get_task_logger(__name__)
 
@@ -36,10 +44,140 @@ def generate_offer_description(offer_id, *_):
     get_content_manager().rewrite_description(Offer.objects.get(pk=offer_id))
 
 
+def reset_peak_rss() -> bool:
+    """
+    Resets peak resident set size of the process, so the peak of an ingest run isn't hidden by earlier tasks
+    executed by the same worker. Only Linux supports it.
+    :return: whether the peak is reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def get_peak_rss() -> int:
+    """
+    :return: peak resident set size of the process in kilobytes, since `reset_peak_rss` if it succeeded
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # lifetime peak, macOS reports it in bytes
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def finish_ingest_run(run: IngestRun, stats: OffersIngestStats = None, peak_rss_reset: bool = False):
+    if stats:
+        run.bytes_fetched = stats.bytes_fetched
+        run.snapshot = stats.snapshot
+        run.new_offers = stats.new
+        run.changed_offers = stats.changed
+        run.unchanged_offers = stats.unchanged
+        run.vanished_offers = stats.vanished
+        run.categories = stats.categories
+        run.orphaned_categories = stats.orphaned_categories
+        run.removed_categories = stats.removed_categories
+        run.errors = stats.errors
+        for stage in ['download', 'parse', 'categories', 'upsert', 'reconcile']:
+            setattr(run, f'{stage}_time', stats.timings.get(stage))
+    run.finished_at = timezone.now()
+    run.wall_time = (run.finished_at - run.started_at).total_seconds()
+    run.peak_rss = get_peak_rss()
+    run.peak_rss_scope = IngestRun.PEAK_RSS_RUN if peak_rss_reset else IngestRun.PEAK_RSS_PROCESS
+    run.save()
+
+
 @shared_task()
-def update_feed(supplier_id: int):
+def update_feed(supplier_id: int) -> Dict:
+    """
+    Updates supplier feed and records the run to IngestRun journal
+    :return: outcome of the update: status (updated, not_modified, locked or failed), duration and ingest stats
+    """
     supplier = Supplier.objects.get(pk=supplier_id)
-    load_offers(supplier)
+    run = IngestRun.objects.create(supplier=supplier)
+    peak_rss_reset = reset_peak_rss()
+    stats = None
+    try:
+        with supplier_feed_lock(supplier):
+            stats = load_offers(supplier)
+    except FeedLocked:
+        logger.info(f'{supplier} feed is already being updated, skipping')
+        run.status = IngestRun.STATUS_LOCKED
+    except Exception as ex:
+        logger.exception(f'{supplier} feed update failed')
+        run.status = IngestRun.STATUS_FAILED
+        run.error = repr(ex)
+    else:
+        if stats:
+            logger.info(f'{supplier} feed updated: {stats}')
+            run.status = IngestRun.STATUS_UPDATED
+            schedule_feed_rebuild(get_offer_shard_names(Offer.objects.filter(supplier_offer__supplier=supplier)))
+        else:
+            run.status = IngestRun.STATUS_NOT_MODIFIED
+
+    finish_ingest_run(run, stats, peak_rss_reset)
+    return {
+        'supplier': supplier.name,
+        'run': run.pk,
+        'status': run.status,
+        'duration': round(run.wall_time, 3),
+        'stats': asdict(stats) if stats else None,
+        'error': run.error or None,
+    }
+
+
+@shared_task()
+def update_feeds():
+    """
+    Updates feeds of all active suppliers in parallel
+    """
+    tasks = [update_feed.s(id_) for id_ in Supplier.objects.filter(active=True).values_list('pk', flat=True)]
+    chord(tasks)(report_feeds_update.s())
+
+
+@shared_task()
+def report_feeds_update(results: List[Dict]):
+    for result in sorted(results, key=lambda r: r['duration'], reverse=True):
+        logger.info(
+            f'{result["supplier"]}: {result["status"]} in {result["duration"]}s'
+            + (f', {result["stats"]}' if result['stats'] else '')
+            + (f', {result["error"]}' if result['error'] else '')
+        )
+    return results
+
+
+@shared_task()
+def rebuild_feed():
+    build_dir = build_feed_file()
+    logger.info(f'Feed rebuilt: {build_dir.name}')
+
+
+@shared_task()
+def rebuild_feed_shard(shard: str):
+    build_dir = build_feed_shard(shard)
+    if build_dir is None:
+        logger.info(f'Feed shard {shard} removed')
+    else:
+        logger.info(f'Feed shard {shard} rebuilt: {build_dir.name}')
+
+
+@shared_task()
+def rebuild_feed_shards():
+    """
+    Rebuilds all feed shards in parallel and removes the ones which don't exist anymore
+    """
+    removed = prune_shards()
+    if removed:
+        logger.info(f'Feed shards removed: {removed}')
+    group(rebuild_feed_shard.s(shard) for shard in get_shard_names())()
 
 
 @shared_task()
@@ -115,5 +253,4 @@ def update_suggested_prices():
 
 @shared_task()
 def generate_merchant_center_xml():
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(agenerate_merchant_center_xml())
+    asyncio.run(agenerate_merchant_center_xml())
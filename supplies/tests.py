@@ -1,3 +1,506 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import brotli
+import cv2
+import httpx
+import numpy as np
+from asgiref.sync import async_to_sync
+
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from lxml import etree as ET
+from openpyxl import load_workbook
+
+from supplies.dto import OffersIngestStats
+from supplies.models import Supplier, SupplierCategory, SupplierOffer, Offer, SiteCategory, ImageTextVerdict
+from supplies.services.artifacts import build_feed_file, build_feed_shard, get_shard_names, get_shard_offers, \
+    get_shard_dir, prune_shards
+from supplies.services.categories import CATEGORY_TREE_VERSION_KEY, get_category_tree
+from supplies.services.delta import InvalidDeltaRequest, make_cursor, parse_since, parse_fields, DEFAULT_DELTA_FIELDS
+from supplies.services.feed import (
+    sync_categories, save_offers, iter_offer_rows, offer_row_to_data, iter_offers_xml, evict_offer_fragments,
+    lookup_offer_fragments, OFFER_VERSION_COLUMNS, HostLimiter, ImageVerdicts, image_has_text, MIN_TEXT_REGIONS
+)
+from supplies.services.mapping import compile_field_mapping, DEFAULT_FIELD_MAPPING
+from supplies.services.spreadsheets import SPREADSHEET_COLUMNS, CSV_BOM
+from supplies.services.pricing import load_offer_prices, compute_prices
+
+
+def build_feed(offers, categories=((1, None, 'Root'),)) -> bytes:
+    """
+    :param offers: (id, price, available) of every offer
+    :param categories: (id, parent id, name) of every category
+    """
+    categories_xml = ''.join(
+        f'<category id="{id_}"' + (f' parentId="{parent_id}"' if parent_id else '') + f'>{name}</category>'
+        for id_, parent_id, name in categories
+    )
+    offers_xml = ''.join(
+        f'<offer id="{id_}" available="{str(available).lower()}"><price>{price}</price><currencyId>UAH</currencyId>'
+        f'<categoryId>1</categoryId><name>Offer {id_}</name><vendorCode>V{id_}</vendorCode>'
+        f'<description>Description</description><picture>http://example.com/{id_}.jpg</picture></offer>'
+        for id_, price, available in offers
+    )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><yml_catalog><shop><categories>{categories_xml}</categories>'
+        f'<offers>{offers_xml}</offers></shop></yml_catalog>'
+    ).encode()
+
+
+def create_offer(supplier: Supplier, id_: str, **fields) -> Offer:
+    """
+    :param fields: SupplierOffer fields, Offer fields prefixed with `offer__`
+    """
+    offer_fields = {k.removeprefix('offer__'): fields.pop(k) for k in list(fields) if k.startswith('offer__')}
+    supplier_offer = SupplierOffer.objects.create(**{
+        'supplier': supplier, 'id': id_, 'available': True, 'price': Decimal(100), 'currencyId': 'UAH',
+        'name': f'Offer {id_}', 'name_ua': f'Offer {id_}', 'vendorCode': id_, 'description': '',
+        'description_ua': '', 'pictures': [], **fields,
+    })
+    return Offer.objects.create(supplier_offer=supplier_offer, **{'active': True, **offer_fields})
+
+
+class SyncCategoriesTestCase(TestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='Supplier', feed_url='http://example.com/feed.xml')
+
+    def test_children_listed_before_parents(self):
+        stats = OffersIngestStats()
+        ids = sync_categories({3: (2, 'Grandchild'), 2: (1, 'Child'), 1: (None, 'Root')}, self.supplier, stats)
+
+        self.assertEqual(ids, {1, 2, 3})
+        self.assertEqual(stats.categories, 3)
+        self.assertEqual(SupplierCategory.objects.get(pk=3).parent_category_id, 2)
+        self.assertEqual(SupplierCategory.objects.get(pk=2).parent_category_id, 1)
+
+    def test_orphaned_and_removed_categories(self):
+        sync_categories({1: (None, 'Root'), 2: (1, 'Child')}, self.supplier, OffersIngestStats())
+
+        stats = OffersIngestStats()
+        # 4 references the unknown category, 5 and 6 form a cycle, 2 is missing
+        ids = sync_categories(
+            {1: (None, 'Root'), 3: (2, 'Known parent'), 4: (100, 'Orphan'), 5: (6, 'Cycle'), 6: (5, 'Cycle')},
+            self.supplier,
+            stats,
+        )
+
+        self.assertEqual(ids, {1, 2, 3})
+        self.assertEqual(stats.categories, 2)
+        self.assertEqual(stats.orphaned_categories, 3)
+        self.assertEqual(stats.removed_categories, 1)
+        self.assertFalse(SupplierCategory.objects.filter(pk__in=[4, 5, 6]).exists())
+        self.assertTrue(SupplierCategory.objects.filter(pk=2).exists())
+
+
+class CategoryTreeTestCase(TestCase):
+    def test_invalidated_by_other_process(self):
+        SiteCategory.objects.create(id=1, name='Root')
+        self.assertEqual(get_category_tree().get_children(None), [1])
+
+        # bulk changes don't send signals, another process invalidates the tree through the shared cache
+        SiteCategory.objects.bulk_create([SiteCategory(id=2, name='Child', parent_category_id=1)])
+        self.assertNotIn(2, get_category_tree())
+        cache.set(CATEGORY_TREE_VERSION_KEY.format(SiteCategory._meta.label), 'other process', timeout=None)
+
+        self.assertEqual(get_category_tree().get_children(1), [2])
+
+
+class SaveOffersTestCase(TestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='Supplier', feed_url='http://example.com/feed.xml')
+
+    def test_unchanged_offers_skipped(self):
+        save_offers(build_feed([('a', 100, True), ('b', 200, True)]), self.supplier)
+        updated_at = SupplierOffer.objects.get(id='a').updated_at
+
+        stats = save_offers(build_feed([('a', 100, True), ('b', 250, True), ('c', 300, True)]), self.supplier)
+
+        self.assertEqual((stats.new, stats.changed, stats.unchanged), (1, 1, 1))
+        self.assertEqual(SupplierOffer.objects.get(id='a').updated_at, updated_at)
+        self.assertEqual(SupplierOffer.objects.get(id='b').price, Decimal(250))
+
+    def test_vanished_offers_counted_once(self):
+        save_offers(build_feed([('a', 100, True), ('b', 200, True)]), self.supplier)
+
+        stats = save_offers(build_feed([('a', 100, True)]), self.supplier)
+        self.assertEqual(stats.vanished, 1)
+        self.assertFalse(SupplierOffer.objects.get(id='b').available)
+
+        stats = save_offers(build_feed([('a', 100, True)]), self.supplier)
+        self.assertEqual(stats.vanished, 0)
+
+    def test_offer_without_id_skipped(self):
+        feed = build_feed([('a', 100, True), ('b', 'broken', True)]).replace(b' id="b"', b'')
+        stats = save_offers(feed.replace(b'<price>100</price>', b'<price>broken</price>'), self.supplier)
+        self.assertEqual(stats.errors, 2)
+
+        stats = save_offers(feed, self.supplier)
+        self.assertEqual((stats.new, stats.errors), (1, 1))
+        self.assertEqual(list(SupplierOffer.objects.values_list('id', flat=True)), ['a'])
+
+    def test_returned_offer_saved_again(self):
+        save_offers(build_feed([('a', 100, True), ('b', 200, True)]), self.supplier)
+        save_offers(build_feed([('a', 100, True)]), self.supplier)
+
+        stats = save_offers(build_feed([('a', 100, True), ('b', 200, True)]), self.supplier)
+
+        self.assertEqual((stats.changed, stats.unchanged), (1, 1))
+        self.assertTrue(SupplierOffer.objects.get(id='b').available)
+
+
+class CompileFieldMappingTestCase(TestCase):
+    def parse(self, handlers, xml):
+        offer_data = {'params': '', 'param_values': [], 'pictures': []}
+        for element in ET.fromstring(xml):
+            if element.tag in handlers:
+                handlers[element.tag](offer_data, element)
+        return offer_data
+
+    def test_default_mapping(self):
+        handlers = compile_field_mapping(DEFAULT_FIELD_MAPPING, {1})
+        offer_data = self.parse(handlers, (
+            '<offer><price>10,5</price><categoryId>1</categoryId><quantity_in_stock>3</quantity_in_stock>'
+            '<pickup>true</pickup>'
+            '<picture>http://example.com/1.jpg</picture><picture>http://example.com/2.jpg</picture>'
+            '<param name="Weight" unit="kg">2</param><unknown>x</unknown></offer>'
+        ))
+
+        self.assertEqual(offer_data['price'], Decimal('10.5'))
+        self.assertEqual(offer_data['category_id'], 1)
+        self.assertEqual(offer_data['quantity_in_stock'], 3)
+        self.assertIs(offer_data['pickup'], True)
+        self.assertEqual(offer_data['pictures'], ['http://example.com/1.jpg', 'http://example.com/2.jpg'])
+        self.assertEqual(offer_data['param_values'], [{'name': 'Weight', 'unit': 'kg', 'value': '2'}])
+        self.assertNotIn('unknown', offer_data)
+
+    def test_supplier_overrides(self):
+        handlers = compile_field_mapping(
+            {**DEFAULT_FIELD_MAPPING, 'stockQuantity': 'quantity_in_stock', 'vendor': None}, []
+        )
+        offer_data = self.parse(handlers, (
+            '<offer><stockQuantity>5</stockQuantity><vendor>Vendor</vendor><categoryId>1</categoryId></offer>'
+        ))
+
+        self.assertEqual(offer_data['quantity_in_stock'], 5)
+        self.assertNotIn('vendor', offer_data)
+        # unknown categories are not referenced
+        self.assertNotIn('category_id', offer_data)
+
+    def test_not_mapped_field(self):
+        with self.assertRaises(ValueError):
+            compile_field_mapping({'digest': 'digest'}, [])
+
+
+class DeltaCursorTestCase(TestCase):
+    def test_cursor(self):
+        moment = timezone.now().replace(microsecond=0)
+        self.assertEqual(parse_since(make_cursor(moment)), moment)
+
+    def test_timestamp(self):
+        self.assertEqual(
+            parse_since('2024-01-02T03:04:05+00:00'), datetime(2024, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc)
+        )
+        self.assertTrue(timezone.is_aware(parse_since('2024-01-02 03:04:05')))
+
+    def test_invalid(self):
+        for value in ['yesterday', '2024-13-40', signing.dumps('2024-01-02', salt='other') + 'x']:
+            with self.assertRaises(InvalidDeltaRequest):
+                parse_since(value)
+
+    def test_fields(self):
+        self.assertEqual(parse_fields(None), tuple(DEFAULT_DELTA_FIELDS))
+        self.assertEqual(parse_fields('price, available'), ('price', 'available'))
+        with self.assertRaises(InvalidDeltaRequest):
+            parse_fields('price,name')
+
+
+class ComputePricesTestCase(TestCase):
+    def test_matches_export(self):
+        supplier = Supplier.objects.create(name='Supplier', feed_url='http://example.com/feed.xml')
+        cases = [
+            # supplier price, old price, discount, suggested price, multiplier
+            (Decimal('100.00'), Decimal('150.00'), None, None, None),
+            (Decimal('100.00'), Decimal('150.00'), Decimal('10.00'), None, Decimal('1.15')),
+            (Decimal('99.99'), Decimal('101.00'), None, None, Decimal('1.37')),
+            (Decimal('80.10'), None, Decimal('5.55'), Decimal('90.05'), Decimal('1.21')),
+            (Decimal('120.00'), Decimal('100.00'), None, Decimal('0.00'), Decimal('0.00')),
+            (Decimal('33.33'), Decimal('40.01'), Decimal('3.33'), None, Decimal('2.50')),
+        ]
+        for i, (price, oldprice, discount, suggested_price, multiplier) in enumerate(cases):
+            supplier_offer = SupplierOffer.objects.create(
+                supplier=supplier, id=str(i), available=True, price=price, oldprice=oldprice, price_old=oldprice,
+                discount=discount, currencyId='UAH', name='Offer', name_ua='Offer', vendorCode=str(i),
+                description='', description_ua='', pictures=[],
+            )
+            Offer.objects.create(
+                supplier_offer=supplier_offer, suggested_price=suggested_price, price_multiplier=multiplier
+            )
+
+        frame = load_offer_prices()
+        prices = compute_prices(frame, frame['price_multiplier'])
+        for row in iter_offer_rows(Offer.objects.all()):
+            offer_data = offer_row_to_data(row)
+            for column in ['price', 'oldprice', 'price_old', 'discount']:
+                with self.subTest(offer=row[0], column=column):
+                    expected = float(offer_data[column]) if column in offer_data else None
+                    actual = prices.loc[row[0], column]
+                    self.assertEqual(None if actual != actual else actual, expected)
+
+
+class OfferFragmentCacheTestCase(TestCase):
+    def setUp(self):
+        evict_offer_fragments()
+        self.supplier = Supplier.objects.create(name='Supplier', feed_url='http://example.com/feed.xml')
+
+    def render(self) -> bytes:
+        return b''.join(iter_offers_xml(Offer.objects.order_by('pk'), workers=1))
+
+    def test_partial_save_rerenders_offer(self):
+        offer = create_offer(self.supplier, 'a')
+        self.assertIn(b'<name>Offer a</name>', self.render())
+
+        # eviction by the signal reaches the fragment cache of this process only, other processes rely on the version
+        with mock.patch('supplies.signals.evict_offer_fragments'):
+            offer.name = 'Rewritten title'
+            offer.save(update_fields=['name'])
+
+        self.assertIn(b'<name>Rewritten title</name>', self.render())
+
+    def test_evicted_fragments_rerendered(self):
+        create_offer(self.supplier, 'a')
+        create_offer(self.supplier, 'b')
+        feed = self.render()
+        rows = list(Offer.objects.order_by('pk').values_list(*OFFER_VERSION_COLUMNS))
+        self.assertEqual(lookup_offer_fragments(rows)[1], {})
+
+        evict_offer_fragments()
+
+        self.assertEqual(set(lookup_offer_fragments(rows)[1]), {row[0] for row in rows})
+        self.assertEqual(self.render(), feed)
+
+
+class FeedBuildViewTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        supplier = Supplier.objects.create(name='Supplier', feed_url='http://example.com/feed.xml')
+        create_offer(supplier, 'a')
+        self.build_dir = build_feed_file()
+        self.feed = (self.build_dir / 'feed.xml').read_bytes()
+
+    def test_not_modified(self):
+        response = self.client.get('/feed.xml')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'W/"{self.build_dir.name}"')
+
+        response = self.client.get('/feed.xml', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/feed.xml', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_encoding_negotiated(self):
+        response = self.client.get('/feed.xml', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(b''.join(response.streaming_content)), self.feed)
+
+        response = self.client.get('/feed.xml', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.feed)
+
+        response = self.client.get('/feed.xml')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(b''.join(response.streaming_content), self.feed)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+
+class FeedShardsTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, FEED_SHARD_BY='supplier')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.first = Supplier.objects.create(name='First', feed_url='http://example.com/first.xml')
+        self.second = Supplier.objects.create(name='Second', feed_url='http://example.com/second.xml')
+        self.offer = create_offer(self.first, 'a')
+        create_offer(self.first, 'b')
+
+    def test_shard_membership(self):
+        create_offer(self.second, 'c', offer__active=False)
+        self.assertEqual(get_shard_names(), [f'supplier-{self.first.pk}'])
+        self.assertEqual(
+            set(get_shard_offers(f'supplier-{self.first.pk}').values_list('supplier_offer__id', flat=True)),
+            {'a', 'b'}
+        )
+
+    def test_offer_leaving_shard_rebuilds_it(self):
+        supplier_offer = self.offer.supplier_offer
+        supplier_offer.supplier = self.second
+        with mock.patch('supplies.signals.schedule_feed_rebuild') as schedule_feed_rebuild, \
+                self.captureOnCommitCallbacks(execute=True):
+            supplier_offer.save()
+
+        schedule_feed_rebuild.assert_called_once_with({f'supplier-{self.first.pk}', f'supplier-{self.second.pk}'})
+
+    def test_shards_without_offers_removed(self):
+        first, second = f'supplier-{self.first.pk}', f'supplier-{self.second.pk}'
+        create_offer(self.second, 'c')
+        build_feed_shard(first)
+        build_feed_shard(second)
+
+        Offer.objects.filter(supplier_offer__supplier=self.second).update(active=False)
+        self.assertEqual(prune_shards(), [second])
+        self.assertFalse(get_shard_dir(second).exists())
+
+        Offer.objects.filter(supplier_offer__supplier=self.first).update(active=False)
+        self.assertIsNone(build_feed_shard(first))
+        self.assertFalse(get_shard_dir(first).exists())
+
+
+class ParallelExportTestCase(TransactionTestCase):
+    def setUp(self):
+        # spawned workers connect to the test database on their own, they can't see an in-memory one
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('test database is in memory')
+
+    def test_same_as_serial(self):
+        supplier = Supplier.objects.create(name='Supplier', feed_url='http://example.com/feed.xml')
+        for i in range(25):
+            create_offer(supplier, str(i), offer__name=f'Offer {i} & Co' if i % 2 else None)
+        offers = Offer.objects.order_by('pk')
+
+        evict_offer_fragments()
+        serial = b''.join(iter_offers_xml(offers, chunk_size=4, workers=1))
+        evict_offer_fragments()
+        parallel = b''.join(iter_offers_xml(offers, chunk_size=4, workers=2))
+        # the second export takes fragments rendered by the workers from the cache
+        cached = b''.join(iter_offers_xml(offers, chunk_size=4, workers=2))
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(cached, serial)
+        self.assertEqual(serial.count(b'<offer '), 25)
+
+
+class SpreadsheetExportTestCase(TestCase):
+    def setUp(self):
+        supplier = Supplier.objects.create(name='Supplier', feed_url='http://example.com/feed.xml')
+        self.offer = create_offer(
+            supplier, 'a', description='Bell\x07, "quoted"', params='<param name="Weight" unit="kg">2</param>',
+            pictures=['http://example.com/1.jpg', 'http://example.com/2.jpg'], offer__name='Published name',
+        )
+        create_offer(supplier, 'b', offer__active=False)
+
+    def assert_offer_row(self, row):
+        values = dict(zip(SPREADSHEET_COLUMNS, row))
+        # offers are exported under their own ids, not the supplier ones
+        self.assertEqual(values['id'], str(self.offer.pk))
+        self.assertEqual(values['name'], 'Published name')
+        self.assertEqual(values['params'], 'Weight: 2 kg')
+        self.assertEqual(values['pictures'], 'http://example.com/1.jpg, http://example.com/2.jpg')
+
+    def test_csv(self):
+        response = self.client.get('/feed.csv')
+        content = b''.join(response.streaming_content).decode('utf-8')
+
+        self.assertTrue(content.startswith(CSV_BOM))
+        header, *rows = list(csv.reader(StringIO(content.removeprefix(CSV_BOM))))
+        self.assertEqual(header, SPREADSHEET_COLUMNS)
+        self.assertEqual(len(rows), 1)
+        self.assert_offer_row(rows[0])
+        self.assertEqual(dict(zip(SPREADSHEET_COLUMNS, rows[0]))['description'], 'Bell\x07, "quoted"')
+
+    def test_xlsx(self):
+        response = self.client.get('/feed.xlsx')
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)['Offers']
+
+        header, *rows = list(sheet.values)
+        self.assertEqual(list(header), SPREADSHEET_COLUMNS)
+        self.assertEqual(len(rows), 1)
+        self.assert_offer_row(rows[0])
+        # control characters aren't allowed in XLSX
+        self.assertEqual(dict(zip(SPREADSHEET_COLUMNS, rows[0]))['description'], 'Bell, "quoted"')
+
+
+class HostLimiterTestCase(TestCase):
+    def test_concurrency_limited(self):
+        limiter = HostLimiter(total=3, per_host=2)
+        active = {'total': 0, 'a.com': 0, 'b.com': 0}
+        peaks = dict(active)
+
+        async def request(url, host):
+            async with limiter.limit(url):
+                for key in ['total', host]:
+                    active[key] += 1
+                    peaks[key] = max(peaks[key], active[key])
+                await asyncio.sleep(0.01)
+                for key in ['total', host]:
+                    active[key] -= 1
+
+        async def run():
+            await asyncio.gather(*(
+                request(f'http://{host}/{i}.jpg', host) for i in range(5) for host in ['a.com', 'b.com']
+            ))
+
+        asyncio.run(run())
+        self.assertEqual(peaks, {'total': 3, 'a.com': 2, 'b.com': 2})
+
+
+class ImageVerdictsTestCase(TestCase):
+    URL = 'http://example.com/1.jpg'
+
+    def setUp(self):
+        self.image = cv2.imencode('.png', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+        self.etag = '"v1"'
+        self.honor_etag = True
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        if self.honor_etag and request.headers.get('If-None-Match') == self.etag:
+            return httpx.Response(304)
+        return httpx.Response(200, content=self.image, headers={'ETag': self.etag})
+
+    def check(self):
+        """
+        :return: whether the image has text and stats of the verdicts, as a GMC feed generation sees them
+        """
+        async def run():
+            verdicts = await ImageVerdicts.load([self.URL])
+            async with httpx.AsyncClient(transport=httpx.MockTransport(self.respond)) as client:
+                has_text = await image_has_text(client, HostLimiter(1, 1), verdicts, self.URL)
+            await verdicts.save()
+            return has_text, dict(verdicts.stats)
+
+        # async ORM calls are run in this thread, so they see the test transaction
+        return async_to_sync(run)()
+
+    @mock.patch('supplies.services.feed.swt_text_detection', return_value=[None] * MIN_TEXT_REGIONS)
+    def test_verdict_reused(self, swt_text_detection):
+        self.assertEqual(self.check(), (True, {'detected': 1}))
+        self.assertEqual(ImageTextVerdict.objects.get(url=self.URL).etag, self.etag)
+
+        self.assertEqual(self.check(), (True, {'not_modified': 1}))
+
+        # the same image under a new ETag is not detected again, its ETag is updated
+        self.etag, self.honor_etag = '"v2"', False
+        self.assertEqual(self.check(), (True, {'unchanged': 1}))
+        self.assertEqual(ImageTextVerdict.objects.get(url=self.URL).etag, '"v2"')
+
+        self.image = cv2.imencode('.png', np.ones((8, 8, 3), dtype=np.uint8))[1].tobytes()
+        swt_text_detection.return_value = []
+        self.assertEqual(self.check(), (False, {'detected': 1}))
+        self.assertEqual(swt_text_detection.call_count, 2)
@@ -1,17 +1,137 @@
-from django.http import HttpResponse, HttpResponseNotFound, JsonResponse
+import re
+from pathlib import Path
 
+from django.conf import settings
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, JsonResponse, StreamingHttpResponse, FileResponse
+)
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django.views.generic import View
 
-from supplies.models import Offer
-from supplies.services.feed import generate_offers_xml, generate_merchant_center_xml
+from supplies.services.artifacts import get_current_build, get_exported_offers, get_shard_dir, get_shards_index, \
+    FEED_FILE_NAME
+from supplies.services.delta import InvalidDeltaRequest, parse_since, parse_fields, iter_delta_xml, get_next_cursor
+from supplies.services.feed import generate_merchant_center_xml, iter_offers_xml
+from supplies.services.spreadsheets import iter_offers_csv, write_offers_xlsx
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# pre-compressed feed variants in the order of preference
+FEED_ENCODINGS = [
+    ('br', re.compile(r'\bbr\b'), '.br'),
+    ('gzip', re.compile(r'\bgzip\b'), '.gz'),
+]
+
+
+def serve_feed_build(request, build_dir: Path):
+    """
+    Serves feed build with the pre-compressed variant accepted by the client, supports conditional requests
+    """
+    path = build_dir / FEED_FILE_NAME
+    etag = f'W/"{build_dir.name}"'
+    # HTTP dates have a precision of seconds, If-Modified-Since never matches a fractional mtime
+    last_modified = int(path.stat().st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        encoding = None
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        for name, pattern, suffix in FEED_ENCODINGS:
+            variant = path.with_name(path.name + suffix)
+            if pattern.search(accept_encoding) and variant.exists():
+                encoding, path = name, variant
+                break
+
+        response = FileResponse(open(path, 'rb'), content_type='application/xml', filename=FEED_FILE_NAME)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
 
 
 class XMLFeedView(View):
     def get(self, request):
-        # handle the get request
-        return HttpResponse(generate_offers_xml(
-            Offer.objects.filter(active=True, supplier_offer__available=True).select_related('supplier_offer')
-        ), content_type='application/xml')
+        build_dir = get_current_build()
+        if build_dir is None:
+            # feed is not built yet, it's rendered in the request process since a pool per request is not worth it
+            return StreamingHttpResponse(
+                iter_offers_xml(get_exported_offers(), workers=1), content_type='application/xml'
+            )
+        return serve_feed_build(request, build_dir)
+
+
+class ShardXMLFeedView(View):
+    def get(self, request, shard):
+        build_dir = get_current_build(get_shard_dir(shard))
+        if build_dir is None:
+            return HttpResponseNotFound(f'Feed shard {shard} is not built')
+        return serve_feed_build(request, build_dir)
+
+
+class ShardsIndexView(View):
+    """
+    Lists built feed shards with their URLs and sha256 checksums
+    """
+
+    def get(self, request):
+        shards = [
+            {
+                **shard,
+                'url': request.build_absolute_uri(reverse('feed-shard', args=[shard['name']])),
+                'built_at': http_date(shard['built_at']),
+            }
+            for shard in get_shards_index()
+        ]
+        return JsonResponse({'shard_by': settings.FEED_SHARD_BY, 'shards': shards})
+
+
+class DeltaXMLFeedView(View):
+    """
+    Offers changed since `since` (cursor from the X-Next-Cursor header of the previous response or ISO timestamp)
+    with only the requested comma separated `fields`
+    """
+
+    def get(self, request):
+        if not request.GET.get('since'):
+            return HttpResponseBadRequest('since parameter is required')
+        try:
+            since = parse_since(request.GET['since'])
+            fields = parse_fields(request.GET.get('fields'))
+        except InvalidDeltaRequest as ex:
+            return HttpResponseBadRequest(str(ex))
+
+        # the cursor is taken before the offers are queried, so changes made meanwhile get into the next delta
+        cursor = get_next_cursor()
+        response = StreamingHttpResponse(iter_delta_xml(since, fields), content_type='application/xml')
+        response.headers['X-Next-Cursor'] = cursor
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+
+def offers_csv_response(offer_queryset, filename='offers.csv'):
+    response = StreamingHttpResponse(iter_offers_csv(offer_queryset), content_type='text/csv; charset=utf-8')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def offers_xlsx_response(offer_queryset, filename='offers.xlsx'):
+    return FileResponse(
+        write_offers_xlsx(offer_queryset), content_type=XLSX_CONTENT_TYPE, as_attachment=True, filename=filename
+    )
+
+
+class CSVFeedView(View):
+    def get(self, request):
+        return offers_csv_response(get_exported_offers().order_by('pk'))
+
+
+class XLSXFeedView(View):
+    def get(self, request):
+        return offers_xlsx_response(get_exported_offers().order_by('pk'))
 
 
 class MerchantCenterXMLFeedView(View):
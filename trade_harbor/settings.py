@@ -148,6 +148,55 @@ OPENAI_CREDENTIALS = {
 }
 
 DEEPL_API_KEY = env.get('DEEPL_API_KEY')
+# number of supplier offers written to the database by a single upsert statement
+SUPPLIER_OFFERS_BATCH_SIZE = env.get('SUPPLIER_OFFERS_BATCH_SIZE', int, default=1000)
+# number of downloaded feeds archived per supplier (see supplies.services.snapshots), 0 disables archiving
+FEED_SNAPSHOTS_KEEP = env.get('FEED_SNAPSHOTS_KEEP', int, default=10)
+# deactivate published offers when their supplier offers disappear from the supplier feed
+DEACTIVATE_VANISHED_OFFERS = env.get('DEACTIVATE_VANISHED_OFFERS', env.boolean, default=False)
+
+# number of offers fetched from the database at once while the feed is exported
+FEED_EXPORT_CHUNK_SIZE = env.get('FEED_EXPORT_CHUNK_SIZE', int, default=2000)
+# number of processes rendering offers of the exported feed, 1 renders them in the exporting process
+FEED_EXPORT_WORKERS = env.get('FEED_EXPORT_WORKERS', int, default=1)
+# seconds between the first data change and the materialized feed rebuild, later changes are batched into it
+FEED_REBUILD_DELAY = env.get('FEED_REBUILD_DELAY', int, default=60)
+# feed shards are built per "supplier" or per top-level site "category", see supplies.services.artifacts
+FEED_SHARD_BY = env.get('FEED_SHARD_BY', default='supplier')
+
+# cache of rendered feed <offer> fragments, shared between processes when FEED_CACHE_URL (redis) is configured
+FEED_FRAGMENT_CACHE = 'feed'
+FEED_CACHE_URL = env.get('FEED_CACHE_URL', default=None)
+# default cache is shared by web and worker processes (debounced feed rebuilds, category tree versions),
+# it's redis at CACHE_URL or the database table created by migrations
+CACHE_URL = env.get('CACHE_URL', default=None)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    } if CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'supplies_cache',
+        # culled entries are lost category tree versions and rebuild marks (one per feed shard)
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    FEED_FRAGMENT_CACHE: {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': FEED_CACHE_URL,
+        'TIMEOUT': None,
+    } if FEED_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'feed-fragments',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    },
+}
+
+# concurrent image downloads of the GMC feed generation, in total and to one host, and their timeout in seconds
+MERCHANT_CENTER_IMAGE_CONCURRENCY = env.get('MERCHANT_CENTER_IMAGE_CONCURRENCY', int, default=32)
+MERCHANT_CENTER_IMAGE_PER_HOST_CONCURRENCY = env.get('MERCHANT_CENTER_IMAGE_PER_HOST_CONCURRENCY', int, default=8)
+MERCHANT_CENTER_IMAGE_TIMEOUT = env.get('MERCHANT_CENTER_IMAGE_TIMEOUT', float, default=10.0)
+
 MERCHANT_CENTER_FEED_URL = 'https://miydim.in.ua/google_merchant_center.xml?hash_tag=4983c9be9be0b8a32aee4caeac605bbc&product_ids=&label_ids=&export_lang=uk&group_ids='
 
 
@@ -17,13 +17,18 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 
-from supplies.views import XMLFeedView
+from supplies.views import XMLFeedView, DeltaXMLFeedView, ShardXMLFeedView, ShardsIndexView, CSVFeedView, XLSXFeedView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('feed.xml', XMLFeedView.as_view()),
+    path('feed.csv', CSVFeedView.as_view()),
+    path('feed.xlsx', XLSXFeedView.as_view()),
+    path('feed/delta.xml', DeltaXMLFeedView.as_view()),
+    path('feed/shards/index.json', ShardsIndexView.as_view()),
+    re_path(r'^feed/shards/(?P<shard>[a-z]+-\w+)\.xml$', ShardXMLFeedView.as_view(), name='feed-shard'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 if settings.DEBUG: